@@ -0,0 +1,36 @@
+"""add timer reminders and deadline index
+
+Revision ID: 002_add_timer_reminders
+Revises: 001_add_vault_name
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '002_add_timer_reminders'
+down_revision = '001_add_vault_name'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Expiry and reminder scans are range scans over active deadlines
+    op.create_index('ix_timers_status_deadline', 'timers', ['status', 'deadline', 'user_id'])
+
+    op.create_table(
+        'timer_reminders',
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('window_minutes', sa.Integer(), primary_key=True),
+        sa.Column('deadline', sa.DateTime(), primary_key=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_timer_reminders_deadline', 'timer_reminders', ['deadline'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_timer_reminders_deadline', table_name='timer_reminders')
+    op.drop_table('timer_reminders')
+    op.drop_index('ix_timers_status_deadline', table_name='timers')
@@ -0,0 +1,33 @@
+"""add device heartbeat tokens
+
+Revision ID: 003_add_device_tokens
+Revises: 002_add_timer_reminders
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '003_add_device_tokens'
+down_revision = '002_add_timer_reminders'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'device_tokens',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('revoked_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_device_tokens_user_id', 'device_tokens', ['user_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_device_tokens_user_id', table_name='device_tokens')
+    op.drop_table('device_tokens')
@@ -0,0 +1,44 @@
+"""add check-in history and daily summaries
+
+Revision ID: 004_add_checkin_history
+Revises: 003_add_device_tokens
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '004_add_checkin_history'
+down_revision = '003_add_device_tokens'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'checkin_events',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('checked_in_at', sa.DateTime(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+    )
+    op.create_index('ix_checkin_events_user_time', 'checkin_events', ['user_id', 'checked_in_at'])
+    op.create_index('ix_checkin_events_checked_in_at', 'checkin_events', ['checked_in_at'], postgresql_using='brin')
+
+    op.create_table(
+        'checkin_daily_summaries',
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('checkin_count', sa.Integer(), nullable=False),
+        sa.Column('first_checkin', sa.DateTime(), nullable=False),
+        sa.Column('last_checkin', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('checkin_daily_summaries')
+    op.drop_index('ix_checkin_events_checked_in_at', table_name='checkin_events')
+    op.drop_index('ix_checkin_events_user_time', table_name='checkin_events')
+    op.drop_table('checkin_events')
@@ -0,0 +1,30 @@
+"""add shard directory
+
+Revision ID: 005_add_shard_directory
+Revises: 004_add_checkin_history
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '005_add_shard_directory'
+down_revision = '004_add_checkin_history'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Only read on shard 0, but created everywhere so all shards share one schema
+    op.create_table(
+        'shard_directory',
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('shard_id', sa.Integer(), nullable=False),
+        sa.Column('moved_at', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('shard_directory')
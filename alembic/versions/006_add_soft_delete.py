@@ -0,0 +1,39 @@
+"""add soft delete
+
+Revision ID: 006_add_soft_delete
+Revises: 005_add_shard_directory
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006_add_soft_delete'
+down_revision = '005_add_shard_directory'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('vaults', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('beneficiaries', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    op.create_index('ix_users_deleted_at', 'users', ['deleted_at'], postgresql_where=sa.text('deleted_at IS NOT NULL'))
+    op.create_index('ix_vaults_user_live', 'vaults', ['user_id'], postgresql_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_vaults_deleted_at', 'vaults', ['deleted_at'], postgresql_where=sa.text('deleted_at IS NOT NULL'))
+    op.create_index('ix_beneficiaries_user_live', 'beneficiaries', ['user_id'], postgresql_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_beneficiaries_deleted_at', 'beneficiaries', ['deleted_at'], postgresql_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_beneficiaries_deleted_at', table_name='beneficiaries')
+    op.drop_index('ix_beneficiaries_user_live', table_name='beneficiaries')
+    op.drop_index('ix_vaults_deleted_at', table_name='vaults')
+    op.drop_index('ix_vaults_user_live', table_name='vaults')
+    op.drop_index('ix_users_deleted_at', table_name='users')
+
+    op.drop_column('beneficiaries', 'deleted_at')
+    op.drop_column('vaults', 'deleted_at')
+    op.drop_column('users', 'deleted_at')
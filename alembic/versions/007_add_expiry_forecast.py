@@ -0,0 +1,42 @@
+"""add expiry forecast
+
+Revision ID: 007_add_expiry_forecast
+Revises: 006_add_soft_delete
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007_add_expiry_forecast'
+down_revision = '006_add_soft_delete'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'expiry_forecast',
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('stripe', sa.Integer(), nullable=False),
+        sa.Column('expiring', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('bucket_start', 'stripe'),
+    )
+    # Seed from the existing timers, in the default 60 minute buckets and 16
+    # stripes; run the rebuild_expiry_forecasts task if those are changed
+    op.execute(
+        """
+        INSERT INTO expiry_forecast (bucket_start, stripe, expiring)
+        SELECT date_bin('60 minutes', deadline, TIMESTAMP '2000-01-01'),
+               ('x' || right(replace(user_id::text, '-', ''), 8))::bit(32)::bigint % 16,
+               count(*)
+        FROM timers
+        WHERE status = 'ACTIVE'
+        GROUP BY 1, 2
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('expiry_forecast')
@@ -0,0 +1,39 @@
+"""add vault quotas
+
+Revision ID: 008_add_vault_quotas
+Revises: 007_add_expiry_forecast
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008_add_vault_quotas'
+down_revision = '007_add_expiry_forecast'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('vault_bytes_used', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('vault_count', sa.Integer(), server_default='0', nullable=False))
+    # Backfill from the live vaults; soft deleted ones no longer count
+    op.execute(
+        """
+        UPDATE users
+        SET vault_bytes_used = usage.used, vault_count = usage.vaults
+        FROM (
+            SELECT user_id, sum(coalesce(octet_length(encrypted_data), 0)) AS used, count(*) AS vaults
+            FROM vaults
+            WHERE deleted_at IS NULL
+            GROUP BY user_id
+        ) AS usage
+        WHERE users.id = usage.user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'vault_count')
+    op.drop_column('users', 'vault_bytes_used')
@@ -0,0 +1,25 @@
+"""page check-in history by (checked_in_at, id)
+
+Revision ID: 009_page_checkin_history_by_id
+Revises: 008_add_vault_quotas
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '009_page_checkin_history_by_id'
+down_revision = '008_add_vault_quotas'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Covers the (checked_in_at, id) keyset used to page a user's history
+    op.create_index('ix_checkin_events_user_time_id', 'checkin_events', ['user_id', 'checked_in_at', 'id'])
+    op.drop_index('ix_checkin_events_user_time', table_name='checkin_events')
+
+
+def downgrade() -> None:
+    op.create_index('ix_checkin_events_user_time', 'checkin_events', ['user_id', 'checked_in_at'])
+    op.drop_index('ix_checkin_events_user_time_id', table_name='checkin_events')
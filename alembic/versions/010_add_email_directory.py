@@ -0,0 +1,35 @@
+"""add email directory
+
+Revision ID: 010_add_email_directory
+Revises: 009_page_checkin_history_by_id
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '010_add_email_directory'
+down_revision = '009_page_checkin_history_by_id'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Only used on shard 0, but created everywhere so all shards share one
+    # schema. Existing accounts need no entries: registration still checks
+    # every shard for the email, the directory only settles concurrent
+    # registrations of a new one.
+    op.create_table(
+        'email_directory',
+        sa.Column('email', sa.String(), primary_key=True),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_email_directory_user_id', 'email_directory', ['user_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_email_directory_user_id', table_name='email_directory')
+    op.drop_table('email_directory')
@@ -0,0 +1,145 @@
+"""Admission control and load shedding tied to connection pool pressure.
+
+Every request is classified into a priority lane (heartbeat > timer reads >
+vault writes and everything else > bulk/export). Each lane has its own
+concurrency limit and a bounded wait queue, and lower-priority lanes are shed
+with ``503 Retry-After`` as soon as the DB pool passes their utilization
+threshold, so heartbeats keep working while Postgres is slow. Admin
+endpoints bypass admission control so that operators and the autoscaler can
+still see the system during the overload they are meant to react to.
+"""
+import asyncio
+from typing import List, Optional
+from starlette.responses import JSONResponse
+
+PRIORITY_HEARTBEAT = 0
+PRIORITY_TIMER_READ = 1
+PRIORITY_DEFAULT = 2
+PRIORITY_BULK = 3
+
+LANE_NAMES = ["heartbeat", "timer_read", "default", "bulk"]
+
+# Cheap endpoints that never touch the database
+EXEMPT_PATHS = {"/", "/health", "/docs", "/redoc", "/openapi.json"}
+
+# Operator and autoscaler endpoints: few callers, and they must keep answering
+# under overload (they are token protected, so this is not an open door)
+EXEMPT_PREFIXES = ("/admin",)
+
+
+def classify(method: str, path: str) -> int:
+    if path.startswith("/heartbeat"):
+        return PRIORITY_HEARTBEAT
+    if path.startswith("/timer") and method == "GET":
+        return PRIORITY_TIMER_READ
+    if path.startswith("/account/export"):
+        return PRIORITY_BULK
+    return PRIORITY_DEFAULT
+
+
+def pool_utilization(pool, max_overflow: int) -> float:
+    """Fraction of the pool's capacity (size + overflow) currently checked out"""
+    capacity = pool.size() + max(max_overflow, 0)
+    return pool.checkedout() / capacity if capacity else 0.0
+
+
+class _Lane:
+    def __init__(self, name: str, limit: int, max_queue: int, shed_utilization: Optional[float]):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.shed_utilization = shed_utilization
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = {"pool": 0, "queue": 0, "timeout": 0}
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+        }
+
+
+class AdmissionControlMiddleware:
+    def __init__(
+        self,
+        app,
+        pool_pressure,
+        concurrency_limits: List[int],
+        max_queue: List[int],
+        shed_pool_utilization: List[Optional[float]],
+        queue_timeout: float = 2.0,
+        retry_after: int = 5,
+    ):
+        self.app = app
+        self.pool_pressure = pool_pressure
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.lanes = [
+            _Lane(name, concurrency_limits[i], max_queue[i], shed_pool_utilization[i])
+            for i, name in enumerate(LANE_NAMES)
+        ]
+        admission_controllers.append(self)
+
+    async def _shed(self, lane: _Lane, reason: str, scope, receive, send) -> None:
+        lane.shed[reason] += 1
+        response = JSONResponse(
+            {"detail": "Server is overloaded, please retry later"},
+            status_code=503,
+            headers={"Retry-After": str(self.retry_after)},
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"] in EXEMPT_PATHS
+            or scope["path"].startswith(EXEMPT_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        lane = self.lanes[classify(scope["method"], scope["path"])]
+
+        if lane.shed_utilization is not None and self.pool_pressure() >= lane.shed_utilization:
+            await self._shed(lane, "pool", scope, receive, send)
+            return
+
+        if lane.semaphore.locked():
+            if lane.queued >= lane.max_queue:
+                await self._shed(lane, "queue", scope, receive, send)
+                return
+            lane.queued += 1
+            try:
+                await asyncio.wait_for(lane.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                await self._shed(lane, "timeout", scope, receive, send)
+                return
+            finally:
+                lane.queued -= 1
+        else:
+            await lane.semaphore.acquire()
+
+        lane.admitted += 1
+        lane.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.in_flight -= 1
+            lane.semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "pool_utilization": round(self.pool_pressure(), 3),
+            "lanes": {lane.name: lane.snapshot() for lane in self.lanes},
+        }
+
+
+# Middleware instances are built lazily by Starlette; keep a handle for the
+# admin endpoint.
+admission_controllers: List[AdmissionControlMiddleware] = []
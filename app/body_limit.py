@@ -0,0 +1,74 @@
+"""Request body size limits, enforced before the body is read.
+
+A request whose ``Content-Length`` is over the limit for its path is answered
+with ``413`` straight away, without reading any of the body. Requests without
+one (chunked uploads) are counted as the body streams in and cut off with
+``413`` as soon as they cross the limit, so an oversized upload is never
+buffered whole.
+"""
+from typing import Iterable, Tuple
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+BODY_METHODS = {"POST", "PUT", "PATCH"}
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail="Request body too large")
+
+
+class BodySizeLimitMiddleware:
+    def __init__(self, app, max_body_size: int, path_limits: Iterable[Tuple[str, int]] = ()):
+        self.app = app
+        self.max_body_size = max_body_size
+        # Longest prefix first, so "/vaults/x" can differ from "/vaults"
+        self.path_limits = sorted(path_limits, key=lambda item: len(item[0]), reverse=True)
+
+    def limit_for(self, path: str) -> int:
+        for prefix, limit in self.path_limits:
+            if path.startswith(prefix):
+                return limit
+        return self.max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in BODY_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limit_for(scope["path"])
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the endpoint's body parsing, so FastAPI turns it into a 413
+                    raise _too_large()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            # The body was read outside a FastAPI endpoint (e.g. by a middleware)
+            if e.status_code != 413 or response_started:
+                raise
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send) -> None:
+        response = JSONResponse({"detail": "Request body too large"}, status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
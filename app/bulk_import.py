@@ -0,0 +1,239 @@
+"""Bulk import of pre-hashed user accounts from NDJSON.
+
+Usage:
+    python -m app.bulk_import accounts.ndjson [--chunk-size 50000]
+
+Each line is one typed record, in the same shape as ``GET /account/export``
+plus a ``hashed_password`` on user records:
+
+    {"type": "user", "id": "...", "email": "...", "hashed_password": "$argon2id$...", "is_active": true}
+    {"type": "timer", "user_id": "...", "timeout_days": 30, "last_checkin": "...", "deadline": "..."}
+    {"type": "vault", "user_id": "...", "name": "...", "encrypted_data": "...", "client_salt": "..."}
+    {"type": "beneficiary", "user_id": "...", "email": "...", "name": "..."}
+
+A user record must appear before any record that references it. Rows are
+routed to their user's shard and loaded with Postgres COPY in foreign key
+order, one transaction per shard per chunk, so a failing chunk is rolled back
+as a whole and earlier chunks stay loaded.
+
+Before its rows are copied, each chunk reserves its users' emails in the
+``email_directory`` on shard 0, like registration does. A chunk holding an
+email that is already reserved for another user fails. Reserving again for
+the same user is a no-op, so a failed import can simply be re-run.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import defaultdict
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta
+from app.crud import stored_bytes
+from app.database import shard_router
+from app.expiry_forecast import forecast_rows
+from app.models import TimerStatus
+
+# Tables in foreign key order, with the columns COPY writes
+COPY_COLUMNS = {
+    "users": ["id", "email", "hashed_password", "is_active"],
+    "timers": ["user_id", "status", "timeout_days", "last_checkin", "deadline"],
+    "vaults": ["id", "user_id", "name", "encrypted_data", "client_salt"],
+    "beneficiaries": ["id", "user_id", "email", "name"],
+}
+
+# Position of the owning user's id in each table's rows
+USER_ID_INDEX = {"users": 0, "timers": 0, "vaults": 1, "beneficiaries": 1}
+
+FORECAST_UPSERT = (
+    "INSERT INTO expiry_forecast (bucket_start, stripe, expiring) VALUES ($1, $2, $3) "
+    "ON CONFLICT (bucket_start, stripe) DO UPDATE SET expiring = expiry_forecast.expiring + EXCLUDED.expiring"
+)
+
+EMAIL_RESERVE = (
+    "INSERT INTO email_directory (email, user_id, created_at) "
+    "SELECT email, user_id, now() AT TIME ZONE 'utc' FROM unnest($1::text[], $2::uuid[]) AS new(email, user_id) "
+    "ON CONFLICT (email) DO NOTHING"
+)
+
+EMAIL_CONFLICTS = (
+    "SELECT new.email FROM unnest($1::text[], $2::uuid[]) AS new(email, user_id) "
+    "JOIN email_directory ON email_directory.email = new.email WHERE email_directory.user_id <> new.user_id"
+)
+
+USAGE_UPDATE = (
+    "UPDATE users SET vault_bytes_used = vault_bytes_used + $2, vault_count = vault_count + $3 WHERE id = $1"
+)
+
+
+def _user_row(record: dict) -> tuple:
+    return (
+        uuid.UUID(record["id"]),
+        record["email"],
+        record["hashed_password"],
+        record.get("is_active", True),
+    )
+
+
+def _timer_row(record: dict) -> tuple:
+    timeout_days = int(record["timeout_days"])
+    last_checkin = datetime.fromisoformat(record["last_checkin"]) if record.get("last_checkin") else datetime.utcnow()
+    if record.get("deadline"):
+        deadline = datetime.fromisoformat(record["deadline"])
+    else:
+        deadline = last_checkin + timedelta(days=timeout_days)
+    return (
+        uuid.UUID(record["user_id"]),
+        TimerStatus(record.get("status", TimerStatus.ACTIVE.value)).value,
+        timeout_days,
+        last_checkin,
+        deadline,
+    )
+
+
+def _vault_row(record: dict) -> tuple:
+    return (
+        uuid.UUID(record["id"]) if record.get("id") else uuid.uuid4(),
+        uuid.UUID(record["user_id"]),
+        record["name"],
+        record.get("encrypted_data"),
+        record.get("client_salt"),
+    )
+
+
+def _beneficiary_row(record: dict) -> tuple:
+    return (
+        uuid.UUID(record["id"]) if record.get("id") else uuid.uuid4(),
+        uuid.UUID(record["user_id"]),
+        record["email"],
+        record["name"],
+    )
+
+
+RECORD_TYPES = {
+    "user": ("users", _user_row),
+    "timer": ("timers", _timer_row),
+    "vault": ("vaults", _vault_row),
+    "beneficiary": ("beneficiaries", _beneficiary_row),
+}
+
+
+def parse_record(record: dict) -> tuple:
+    """Map one NDJSON record to its (table, row) pair"""
+    try:
+        table, to_row = RECORD_TYPES[record["type"]]
+    except KeyError:
+        raise ValueError(f"unknown record type: {record.get('type')!r}")
+    return table, to_row(record)
+
+
+async def _reserve_emails(directory, users: list) -> None:
+    """Reserve the users' emails on shard 0, all or none"""
+    emails = [row[1] for row in users]
+    user_ids = [row[0] for row in users]
+    async with directory.transaction():
+        await directory.execute(EMAIL_RESERVE, emails, user_ids)
+        conflicts = await directory.fetch(EMAIL_CONFLICTS, emails, user_ids)
+        if conflicts:
+            # Raising rolls back this chunk's reservations
+            taken = ", ".join(sorted({row["email"] for row in conflicts}))
+            raise ValueError(f"emails already registered to other users: {taken}")
+
+
+async def _copy_chunk(connection, buffers: dict) -> None:
+    async with connection.transaction():
+        for table, columns in COPY_COLUMNS.items():
+            if buffers[table]:
+                await connection.copy_records_to_table(table, records=buffers[table], columns=columns)
+        # Count the new active timers in the expiry forecast, in the same transaction
+        forecast = forecast_rows(
+            (row[0], row[4], 1) for row in buffers["timers"] if row[1] == TimerStatus.ACTIVE.value
+        )
+        if forecast:
+            await connection.executemany(
+                FORECAST_UPSERT, [(row["bucket_start"], row["stripe"], row["expiring"]) for row in forecast]
+            )
+        # Imported vaults count towards their owner's quota (quotas are not enforced here)
+        usage = defaultdict(lambda: [0, 0])
+        for row in buffers["vaults"]:
+            usage[row[1]][0] += stored_bytes(row[3])
+            usage[row[1]][1] += 1
+        if usage:
+            await connection.executemany(
+                USAGE_UPDATE, [(user_id, used, count) for user_id, (used, count) in sorted(usage.items())]
+            )
+    for rows in buffers.values():
+        rows.clear()
+
+
+async def import_file(path: str, chunk_size: int = 50000) -> int:
+    """Load an NDJSON file and return the number of rows imported"""
+    buffers = {
+        shard_id: {table: [] for table in COPY_COLUMNS}
+        for shard_id in shard_router.shard_ids
+    }
+    pending = 0
+    total = 0
+    started = time.perf_counter()
+
+    async with AsyncExitStack() as stack:
+        connections = {}
+        for shard_id in shard_router.shard_ids:
+            conn = await stack.enter_async_context(shard_router.engine(shard_id).connect())
+            raw_connection = await conn.get_raw_connection()
+            connections[shard_id] = raw_connection.driver_connection
+
+        async def flush():
+            users = [row for shard_id in connections for row in buffers[shard_id]["users"]]
+            if users:
+                await _reserve_emails(connections[0], users)
+            for shard_id, connection in connections.items():
+                await _copy_chunk(connection, buffers[shard_id])
+
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    table, row = parse_record(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{path}:{line_no}: {e}") from e
+
+                # Imported users are new, so they live on their hash ring shard
+                shard_id = shard_router.ring.shard_for(row[USER_ID_INDEX[table]])
+                buffers[shard_id][table].append(row)
+                pending += 1
+                if pending >= chunk_size:
+                    await flush()
+                    total += pending
+                    pending = 0
+                    elapsed = time.perf_counter() - started
+                    print(f"Imported {total} rows ({total / elapsed:.0f} rows/s)")
+
+        if pending:
+            await flush()
+            total += pending
+
+    elapsed = time.perf_counter() - started
+    print(f"Imported {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import pre-hashed accounts from NDJSON")
+    parser.add_argument("path", help="NDJSON file to import")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="rows per COPY transaction")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            await import_file(args.path, args.chunk_size)
+        finally:
+            await shard_router.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
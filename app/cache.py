@@ -0,0 +1,25 @@
+from redis import asyncio as aioredis
+from app.config import settings
+
+_redis = None
+
+
+def get_redis() -> aioredis.Redis:
+    """Shared Redis client for this process (created lazily)"""
+    global _redis
+    if _redis is None:
+        _redis = aioredis.from_url(settings.redis_url)
+    return _redis
+
+
+async def close_redis() -> None:
+    global _redis
+    if _redis is not None:
+        await _redis.close()
+        _redis = None
+
+
+def reset_redis() -> None:
+    """Forget the client without closing it, e.g. in a forked child whose connections belong to the parent"""
+    global _redis
+    _redis = None
@@ -0,0 +1,99 @@
+"""Buffered, batched writer for the check-in history table.
+
+Heartbeat handlers call ``recorder.record()``, which only appends to an
+in-memory buffer, so writing history adds no database round trip to a
+check-in. A background task flushes the buffer with one multi-row INSERT
+every ``checkin_history_flush_interval_seconds`` or as soon as
+``checkin_history_batch_size`` events are waiting. Events still buffered when
+a process dies are lost; the timer itself is always written synchronously.
+"""
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional
+from uuid import UUID
+from sqlalchemy.exc import IntegrityError
+from app.config import settings
+from app.database import shard_router
+from app import crud
+
+
+class CheckinRecorder:
+    def __init__(self, flush_interval: float, batch_size: int, max_buffer: int):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._buffer: List[dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def record(self, user_id: UUID, checked_in_at: datetime, source: str) -> None:
+        if len(self._buffer) >= self.max_buffer:
+            # The database is not keeping up; shed history rather than memory
+            self.dropped += 1
+            return
+        self._buffer.append({"user_id": user_id, "checked_in_at": checked_in_at, "source": source})
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        while self._buffer:
+            batch = self._buffer[:self.batch_size]
+            del self._buffer[:self.batch_size]
+
+            by_shard = defaultdict(list)
+            for event in batch:
+                by_shard[await shard_router.shard_for(event["user_id"])].append(event)
+
+            failed = []
+            for shard_id, events in by_shard.items():
+                try:
+                    async with shard_router.sessionmaker(shard_id)() as session:
+                        await crud.insert_checkin_events(session, events)
+                except IntegrityError:
+                    # A user in the batch was purged since checking in; write the
+                    # rest one by one and drop theirs, since retrying cannot succeed
+                    for event in events:
+                        try:
+                            async with shard_router.sessionmaker(shard_id)() as session:
+                                await crud.insert_checkin_events(session, [event])
+                        except IntegrityError:
+                            print(f"Dropping check-in history for deleted user {event['user_id']}")
+                        except Exception as e:
+                            print(f"Error writing check-in history: {e}")
+                            failed.append(event)
+                except Exception as e:
+                    print(f"Error writing check-in history: {e}")
+                    failed.extend(events)
+            if failed:
+                # Put failed events back (within the buffer bound) and retry later
+                self._buffer[:0] = failed[:max(self.max_buffer - len(self._buffer), 0)]
+                return
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Shielded so stop() never cancels a batch halfway through its INSERT
+            await asyncio.shield(self.flush())
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+recorder = CheckinRecorder(
+    flush_interval=settings.checkin_history_flush_interval_seconds,
+    batch_size=settings.checkin_history_batch_size,
+    max_buffer=settings.checkin_history_max_buffer,
+)
@@ -0,0 +1,274 @@
+"""Content-negotiated response compression (zstd, brotli, gzip).
+
+Unlike Starlette's ``GZipMiddleware`` this negotiates between several
+encodings, never buffers a response to compress it (each body chunk is
+compressed and forwarded as it arrives, large chunks in slices off the event
+loop), and keeps per-endpoint counters of bytes saved and CPU spent.
+"""
+import time
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, Optional
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+# Large bodies are compressed in slices of this size so output starts flowing
+# before the whole body has been processed, and slices are compressed in a
+# worker thread so a multi-MB vault does not stall the event loop.
+SLICE_SIZE = 256 * 1024
+
+# Stats key for requests that matched no route
+UNMATCHED_ENDPOINT = "<unmatched>"
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def available_encodings() -> list:
+    """Supported encodings in server preference order"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: str, supported: Iterable[str]) -> Optional[str]:
+    """Pick the encoding with the highest q-value, breaking ties by server preference"""
+    supported = list(supported)
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class CompressionStats:
+    """Per-endpoint compression counters (per process)"""
+
+    def __init__(self):
+        self._endpoints = defaultdict(lambda: {
+            "responses": 0,
+            "compressed": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "cpu_seconds": 0.0,
+        })
+
+    def record(self, endpoint: str, bytes_in: int, bytes_out: int, cpu_seconds: float, compressed: bool) -> None:
+        stats = self._endpoints[endpoint]
+        stats["responses"] += 1
+        if compressed:
+            stats["compressed"] += 1
+            stats["bytes_in"] += bytes_in
+            stats["bytes_out"] += bytes_out
+            stats["cpu_seconds"] += cpu_seconds
+
+    def snapshot(self) -> dict:
+        return {
+            endpoint: {
+                "responses": stats["responses"],
+                "compressed": stats["compressed"],
+                "bytes_in": stats["bytes_in"],
+                "bytes_out": stats["bytes_out"],
+                "bytes_saved": stats["bytes_in"] - stats["bytes_out"],
+                "cpu_ms": round(stats["cpu_seconds"] * 1000, 3),
+            }
+            for endpoint, stats in self._endpoints.items()
+        }
+
+
+compression_stats = CompressionStats()
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        excluded_paths: Iterable[str] = (),
+        gzip_level: int = 5,
+        brotli_quality: int = 4,
+        zstd_level: int = 3,
+        stats: CompressionStats = compression_stats,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.excluded_paths = tuple(excluded_paths)
+        self.encodings = available_encodings()
+        self.stats = stats
+        self._encoder_factories = {
+            "gzip": lambda: _GzipEncoder(gzip_level),
+            "br": lambda: _BrotliEncoder(brotli_quality),
+            "zstd": lambda: _ZstdEncoder(zstd_level),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_paths):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, scope, send, encoding)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, scope, send, encoding: str):
+        self.middleware = middleware
+        self.scope = scope
+        self._send = send
+        self.encoding = encoding
+        self.start_message = None
+        self.encoder = None
+        self.passthrough = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def _endpoint(self) -> str:
+        # Key on the route template only; raw paths of unmatched requests
+        # (404s, scanners) would grow the stats without bound
+        route = self.scope.get("route")
+        if route is None:
+            return UNMATCHED_ENDPOINT
+        return f"{self.scope['method']} {route.path}"
+
+    async def _compress(self, data: bytes, finish: bool) -> bytes:
+        started = time.thread_time()
+        if len(data) < SLICE_SIZE:
+            output = self.encoder.compress(data)
+            if finish:
+                output += self.encoder.finish()
+            self.cpu_seconds += time.thread_time() - started
+            return output
+
+        # Large chunk: compress slice by slice in a worker thread and forward
+        # output as it is produced instead of holding the compressed body.
+        view = memoryview(data)
+        for offset in range(0, len(view), SLICE_SIZE):
+            piece = bytes(view[offset:offset + SLICE_SIZE])
+            output, cpu = await anyio.to_thread.run_sync(self._timed_compress, piece)
+            self.cpu_seconds += cpu
+            if output:
+                self.bytes_out += len(output)
+                await self._send({"type": "http.response.body", "body": output, "more_body": True})
+        if finish:
+            started = time.thread_time()
+            output = self.encoder.finish()
+            self.cpu_seconds += time.thread_time() - started
+            return output
+        return b""
+
+    def _timed_compress(self, data: bytes):
+        started = time.thread_time()
+        output = self.encoder.compress(data)
+        return output, time.thread_time() - started
+
+    async def send(self, message) -> None:
+        if message["type"] == "http.response.start":
+            # Hold the start message until the first body chunk tells us
+            # whether the response is worth compressing.
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is None:
+            headers = Headers(raw=self.start_message["headers"])
+            content_length = headers.get("content-length")
+            too_small = (
+                int(content_length) < self.middleware.minimum_size
+                if content_length is not None
+                else not more_body and len(body) < self.middleware.minimum_size
+            )
+            if too_small or "content-encoding" in headers:
+                self.passthrough = True
+                self.middleware.stats.record(self._endpoint(), 0, 0, 0.0, compressed=False)
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+
+            self.encoder = self.middleware._encoder_factories[self.encoding]()
+            mutable = MutableHeaders(raw=self.start_message["headers"])
+            del mutable["content-length"]
+            mutable["Content-Encoding"] = self.encoding
+            mutable.add_vary_header("Accept-Encoding")
+            await self._send(self.start_message)
+
+        self.bytes_in += len(body)
+        output = await self._compress(body, finish=not more_body)
+        self.bytes_out += len(output)
+        await self._send({"type": "http.response.body", "body": output, "more_body": more_body})
+
+        if not more_body:
+            self.middleware.stats.record(
+                self._endpoint(), self.bytes_in, self.bytes_out, self.cpu_seconds, compressed=True
+            )
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, List
 
 
 class Settings(BaseSettings):
@@ -8,6 +8,89 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    # How long a device token's active/revoked state is cached in Redis.
+    # Revocations overwrite the entry, so it can live long; expiry only bounds
+    # the damage if Redis loses a revocation write
+    device_token_cache_seconds: int = 6 * 3600
+
+    # Additional shard databases (shard 0 is database_url)
+    shard_database_urls: List[str] = []
+    shard_virtual_nodes: int = 256
+    shard_directory_cache_ttl_seconds: float = 5.0
+    shard_directory_cache_size: int = 100000
+    # An email reservation whose user still does not exist after this long is
+    # left over from a failed registration and may be reclaimed
+    email_reservation_timeout_seconds: int = 300
+
+    # Connection pool (per shard)
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30.0
+
+    # Pre-deadline reminders (minutes before the deadline, e.g. 7 days, 1 day, 1 hour)
+    reminder_windows_minutes: List[int] = [10080, 1440, 60]
+    reminder_batch_size: int = 1000
+    reminder_check_interval_minutes: int = 10
+
+    # Check-in history: buffered batch inserts, compacted into daily summaries
+    checkin_history_flush_interval_seconds: float = 1.0
+    checkin_history_batch_size: int = 500
+    checkin_history_max_buffer: int = 100000
+    checkin_history_retention_days: int = 90
+    checkin_summary_retention_days: int = 730
+    checkin_compaction_batch_size: int = 10000
+
+    # Background purge of soft-deleted rows: small batches with a pause between
+    # them, and a cap per run so one run never hogs a shard
+    purge_interval_minutes: int = 10
+    purge_batch_size: int = 100
+    purge_batch_pause_seconds: float = 0.2
+    purge_max_batches_per_run: int = 500
+
+    # Per-user vault storage quotas (bytes of ciphertext, number of vaults)
+    vault_quota_bytes: int = 50 * 1024 * 1024
+    vault_quota_count: int = 100
+    # Request bodies over these sizes are rejected before they are read; vault
+    # writes get the quota plus room for the JSON around the ciphertext
+    max_request_body_bytes: int = 1024 * 1024
+    vault_request_overhead_bytes: int = 64 * 1024
+
+    # Expiry forecast: active timers counted per deadline bucket; changing the
+    # bucket width or stripe count needs a rebuild (see README)
+    expiry_forecast_bucket_minutes: int = 60
+    expiry_forecast_stripes: int = 16
+    # /admin/metrics serves a cached aggregate this old at most
+    metrics_cache_seconds: float = 10.0
+
+    # Sampling profiler (off by default): keeps a sampled fraction of requests
+    # and every request or expiry run slower than its threshold
+    profiling_enabled: bool = False
+    profiling_sample_rate: float = 0.01
+    profiling_slow_request_ms: float = 1000.0
+    profiling_slow_task_ms: float = 60000.0
+    profiling_interval_ms: float = 10.0
+    profiling_buffer_size: int = 50
+    profiling_max_statements: int = 200
+
+    # Admin endpoints are disabled unless a token is configured
+    admin_token: Optional[str] = None
+
+    # Response compression; small heartbeat/timer responses are never compressed
+    compression_minimum_size: int = 1024
+    compression_excluded_paths: List[str] = ["/heartbeat", "/timer"]
+    compression_gzip_level: int = 5
+    compression_brotli_quality: int = 4
+    compression_zstd_level: int = 3
+
+    # Admission control, per lane: heartbeat, timer reads, default (vault
+    # writes and everything else), bulk/export. A lane is shed once pool
+    # utilization reaches its threshold; None means never shed on pool pressure.
+    admission_enabled: bool = True
+    admission_concurrency_limits: List[int] = [500, 200, 100, 4]
+    admission_max_queue: List[int] = [1000, 200, 100, 0]
+    admission_shed_pool_utilization: List[Optional[float]] = [None, 1.0, 0.9, 0.75]
+    admission_queue_timeout: float = 2.0
+    admission_retry_after_seconds: int = 5
 
     class Config:
         env_file = ".env"
@@ -1,14 +1,24 @@
-from datetime import datetime, timedelta
-from typing import Optional, List
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Tuple, AsyncIterator
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, delete, exists, func, or_, literal, tuple_, cast, text, Date, DateTime, Row, Table, ColumnElement
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import uuid
 from uuid import UUID
 from passlib.context import CryptContext
-from app.models import User, Timer, Vault, Beneficiary, TimerStatus
-from app.schemas import UserCreate, TimerCreate, TimerUpdate, VaultCreate, VaultUpdate, BeneficiaryCreate, BeneficiaryUpdate
+from app.config import settings
+from app.models import User, Timer, TimerReminder, CheckinEvent, CheckinDailySummary, DeviceToken, Vault, Beneficiary, TimerStatus, ExpiryForecast, EmailDirectory
+from app.expiry_forecast import forecast_rows
+from app.schemas import UserCreate, TimerCreate, TimerUpdate, VaultCreate, VaultUpdate, BeneficiaryCreate, BeneficiaryUpdate, DeviceTokenCreate, VaultResponse, BeneficiaryResponse
+from app.serialization import response_columns
 
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 
+# Columns read for API responses, matching the response schemas field for field
+VAULT_RESPONSE_COLUMNS = response_columns(Vault, VaultResponse)
+BENEFICIARY_RESPONSE_COLUMNS = response_columns(Beneficiary, BeneficiaryResponse)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -24,24 +34,96 @@ async def get_user(db: AsyncSession, user_id: UUID) -> Optional[User]:
     return result.scalar_one_or_none()
 
 
-async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
-    result = await db.execute(select(User).where(User.email == email))
+async def get_user_by_email(db: AsyncSession, email: str, include_deleted: bool = False) -> Optional[User]:
+    query = select(User).where(User.email == email)
+    if not include_deleted:
+        query = query.where(User.deleted_at.is_(None))
+    result = await db.execute(query)
     return result.scalar_one_or_none()
 
 
-async def create_user(db: AsyncSession, user: UserCreate) -> User:
+async def delete_user(db: AsyncSession, user_id: UUID) -> bool:
+    """Tombstone an account; its rows are removed later by the purge task.
+
+    The timer row is deleted outright so the account can no longer trigger or
+    get reminders; everything else is left for the purger.
+    """
+    result = await db.execute(
+        update(User)
+        .where(User.id == user_id, User.deleted_at.is_(None))
+        .values(deleted_at=datetime.utcnow(), is_active=False)
+        .returning(User.id)
+    )
+    deleted = result.scalar_one_or_none() is not None
+    if deleted:
+        result = await db.execute(
+            delete(Timer).where(Timer.user_id == user_id).returning(Timer.status, Timer.deadline)
+        )
+        timer = result.one_or_none()
+        if timer is not None and timer.status == TimerStatus.ACTIVE:
+            await shift_expiry_forecast(db, [(user_id, timer.deadline, -1)])
+    await db.commit()
+    return deleted
+
+
+async def create_user(db: AsyncSession, user: UserCreate, user_id: Optional[UUID] = None) -> User:
     hashed_password = get_password_hash(user.password)
     db_user = User(
         email=user.email,
         hashed_password=hashed_password,
         is_active=True
     )
+    if user_id is not None:
+        # Sharded deployments pick the id up front to choose the user's shard
+        db_user.id = user_id
     db.add(db_user)
     await db.commit()
     await db.refresh(db_user)
     return db_user
 
 
+async def reserve_email(db: AsyncSession, email: str, user_id: UUID) -> bool:
+    """Claim an email for user_id in the shard 0 email directory; False if already taken"""
+    result = await db.execute(
+        pg_insert(EmailDirectory)
+        .values(email=email, user_id=user_id)
+        .on_conflict_do_nothing()
+        .returning(EmailDirectory.email)
+    )
+    reserved = result.scalar_one_or_none() is not None
+    await db.commit()
+    return reserved
+
+
+async def get_email_reservation(db: AsyncSession, email: str) -> Optional[EmailDirectory]:
+    result = await db.execute(select(EmailDirectory).where(EmailDirectory.email == email))
+    return result.scalar_one_or_none()
+
+
+async def reclaim_email(db: AsyncSession, email: str, stale_user_id: UUID, user_id: UUID) -> bool:
+    """Move an orphaned reservation from stale_user_id to user_id; False if it changed hands meanwhile"""
+    result = await db.execute(
+        update(EmailDirectory)
+        .where(EmailDirectory.email == email, EmailDirectory.user_id == stale_user_id)
+        .values(user_id=user_id, created_at=datetime.utcnow())
+        .returning(EmailDirectory.email)
+    )
+    reclaimed = result.scalar_one_or_none() is not None
+    await db.commit()
+    return reclaimed
+
+
+async def release_emails(db: AsyncSession, user_ids: List[UUID]) -> None:
+    """Drop the email directory entries of these users (on shard 0)"""
+    await db.execute(delete(EmailDirectory).where(EmailDirectory.user_id.in_(user_ids)))
+    await db.commit()
+
+
+async def get_deleted_user_ids(db: AsyncSession, limit: int) -> List[UUID]:
+    result = await db.execute(select(User.id).where(User.deleted_at.is_not(None)).limit(limit))
+    return result.scalars().all()
+
+
 # Timer CRUD
 async def create_timer(db: AsyncSession, user_id: UUID, timer: TimerCreate) -> Timer:
     now = datetime.utcnow()
@@ -55,32 +137,77 @@ async def create_timer(db: AsyncSession, user_id: UUID, timer: TimerCreate) -> T
         deadline=deadline
     )
     db.add(db_timer)
+    await shift_expiry_forecast(db, [(user_id, deadline, 1)])
     await db.commit()
     await db.refresh(db_timer)
     return db_timer
 
 
-async def get_timer(db: AsyncSession, user_id: UUID) -> Optional[Timer]:
-    result = await db.execute(select(Timer).where(Timer.user_id == user_id))
+async def get_timer(db: AsyncSession, user_id: UUID, for_update: bool = False) -> Optional[Timer]:
+    query = select(Timer).where(Timer.user_id == user_id)
+    if for_update:
+        # Callers that move the deadline must see (and hold) the latest row
+        query = query.with_for_update().execution_options(populate_existing=True)
+    result = await db.execute(query)
     return result.scalar_one_or_none()
 
 
 async def update_timer_checkin(db: AsyncSession, user_id: UUID) -> Optional[Timer]:
-    timer = await get_timer(db, user_id)
+    timer = await get_timer(db, user_id, for_update=True)
     if not timer:
         return None
     
     now = datetime.utcnow()
+    previous_deadline = timer.deadline
     timer.last_checkin = now
     timer.deadline = now + timedelta(days=timer.timeout_days)
+    if timer.status == TimerStatus.ACTIVE:
+        await shift_expiry_forecast(db, [(user_id, previous_deadline, -1), (user_id, timer.deadline, 1)])
     
     await db.commit()
     await db.refresh(timer)
     return timer
 
 
+async def checkin_timer(db: AsyncSession, user_id: UUID) -> Optional[Row]:
+    """Single-statement check-in for an active user.
+
+    Returns (last_checkin, deadline, previous_deadline, previous_status); the
+    previous values come from the row locked by the update, for the forecast.
+    """
+    now = datetime.utcnow()
+    previous = (
+        select(Timer.user_id, Timer.deadline, Timer.status)
+        .where(Timer.user_id == user_id)
+        .with_for_update()
+        .subquery("previous")
+    )
+    result = await db.execute(
+        update(Timer)
+        .where(
+            Timer.user_id == previous.c.user_id,
+            exists().where(User.id == user_id, User.is_active.is_(True))
+        )
+        .values(
+            last_checkin=now,
+            deadline=literal(now, DateTime) + func.make_interval(0, 0, 0, Timer.timeout_days)
+        )
+        .returning(
+            Timer.last_checkin,
+            Timer.deadline,
+            previous.c.deadline.label("previous_deadline"),
+            previous.c.status.label("previous_status")
+        )
+    )
+    row = result.one_or_none()
+    if row is not None and row.previous_status == TimerStatus.ACTIVE:
+        await shift_expiry_forecast(db, [(user_id, row.previous_deadline, -1), (user_id, row.deadline, 1)])
+    await db.commit()
+    return row
+
+
 async def update_timer(db: AsyncSession, user_id: UUID, timer_update: "TimerUpdate") -> Optional[Timer]:
-    timer = await get_timer(db, user_id)
+    timer = await get_timer(db, user_id, for_update=True)
     if not timer:
         return None
     
@@ -88,7 +215,10 @@ async def update_timer(db: AsyncSession, user_id: UUID, timer_update: "TimerUpda
         timer.timeout_days = timer_update.timeout_days
         # Recalculate deadline based on new timeout
         now = datetime.utcnow()
+        previous_deadline = timer.deadline
         timer.deadline = now + timedelta(days=timer.timeout_days)
+        if timer.status == TimerStatus.ACTIVE:
+            await shift_expiry_forecast(db, [(user_id, previous_deadline, -1), (user_id, timer.deadline, 1)])
     
     await db.commit()
     await db.refresh(timer)
@@ -99,75 +229,493 @@ async def get_expired_timers(db: AsyncSession) -> List[Timer]:
     now = datetime.utcnow()
     result = await db.execute(
         select(Timer).where(
-            Timer.deadline < now,
-            Timer.status != TimerStatus.TRIGGERED
+            Timer.status == TimerStatus.ACTIVE,
+            Timer.deadline < now
         )
     )
     return result.scalars().all()
 
 
 async def mark_timer_triggered(db: AsyncSession, user_id: UUID) -> Optional[Timer]:
-    timer = await get_timer(db, user_id)
+    timer = await get_timer(db, user_id, for_update=True)
     if not timer:
         return None
     
+    if timer.status == TimerStatus.ACTIVE:
+        await shift_expiry_forecast(db, [(user_id, timer.deadline, -1)])
     timer.status = TimerStatus.TRIGGERED
     await db.commit()
     await db.refresh(timer)
     return timer
 
 
+# Expiry forecast
+async def shift_expiry_forecast(db: AsyncSession, changes: List[Tuple[UUID, Optional[datetime], int]]) -> None:
+    """Apply (user_id, deadline, delta) changes to the forecast counters, in db's open transaction"""
+    rows = forecast_rows(changes)
+    if not rows:
+        return
+    stmt = pg_insert(ExpiryForecast).values(rows)
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ExpiryForecast.bucket_start, ExpiryForecast.stripe],
+            set_={"expiring": ExpiryForecast.expiring + stmt.excluded.expiring}
+        )
+    )
+
+
+async def get_expiry_forecast(db: AsyncSession, until: datetime) -> List[Row]:
+    """Active timers per bucket for every bucket starting before until (overdue buckets included)"""
+    result = await db.execute(
+        select(ExpiryForecast.bucket_start, func.sum(ExpiryForecast.expiring).label("expiring"))
+        .where(ExpiryForecast.bucket_start < until)
+        .group_by(ExpiryForecast.bucket_start)
+        .order_by(ExpiryForecast.bucket_start)
+    )
+    return result.all()
+
+
+async def prune_expiry_forecast(db: AsyncSession, before: datetime) -> int:
+    """Drop emptied counters of past buckets"""
+    result = await db.execute(
+        delete(ExpiryForecast).where(ExpiryForecast.bucket_start < before, ExpiryForecast.expiring == 0)
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def rebuild_expiry_forecast(db: AsyncSession) -> int:
+    """Recount the forecast from the timers table; returns the number of active timers.
+
+    Only for repair or after changing the bucket width or stripe count: it
+    reads every active timer while holding a lock that makes deadline
+    writes wait.
+    """
+    await db.execute(text("LOCK TABLE expiry_forecast IN EXCLUSIVE MODE"))
+    await db.execute(delete(ExpiryForecast))
+    totals = defaultdict(int)
+    active = 0
+    timers = await db.stream(
+        select(Timer.user_id, Timer.deadline)
+        .where(Timer.status == TimerStatus.ACTIVE)
+        .execution_options(yield_per=10000)
+    )
+    async for partition in timers.partitions():
+        for row in forecast_rows((timer.user_id, timer.deadline, 1) for timer in partition):
+            totals[(row["bucket_start"], row["stripe"])] += row["expiring"]
+        active += len(partition)
+    rows = [
+        {"bucket_start": start, "stripe": stripe, "expiring": count}
+        for (start, stripe), count in sorted(totals.items())
+    ]
+    for start in range(0, len(rows), 5000):
+        await db.execute(insert(ExpiryForecast), rows[start:start + 5000])
+    await db.commit()
+    return active
+
+
+# Account export
+async def stream_account_records(db: AsyncSession, user_id: UUID) -> AsyncIterator[dict]:
+    """Yield a user's account as typed records (user, timer, vaults, beneficiaries).
+
+    Vaults and beneficiaries are read through server-side cursors so large
+    accounts are never buffered in memory. Records use the same shape that
+    ``app.bulk_import`` ingests, minus the password hash.
+    """
+    result = await db.execute(
+        select(User.id, User.email, User.is_active).where(User.id == user_id, User.deleted_at.is_(None))
+    )
+    user = result.one_or_none()
+    if user is None:
+        return
+    yield {"type": "user", **user._asdict()}
+
+    result = await db.execute(
+        select(Timer.user_id, Timer.status, Timer.timeout_days, Timer.last_checkin, Timer.deadline)
+        .where(Timer.user_id == user_id)
+    )
+    timer = result.one_or_none()
+    if timer is not None:
+        yield {"type": "timer", **timer._asdict()}
+
+    vaults = await db.stream(
+        select(Vault.id, Vault.user_id, Vault.name, Vault.encrypted_data, Vault.client_salt)
+        .where(Vault.user_id == user_id, Vault.deleted_at.is_(None))
+        .execution_options(yield_per=50)
+    )
+    async for row in vaults:
+        yield {"type": "vault", **row._asdict()}
+
+    beneficiaries = await db.stream(
+        select(Beneficiary.id, Beneficiary.user_id, Beneficiary.email, Beneficiary.name)
+        .where(Beneficiary.user_id == user_id, Beneficiary.deleted_at.is_(None))
+        .execution_options(yield_per=500)
+    )
+    async for row in beneficiaries:
+        yield {"type": "beneficiary", **row._asdict()}
+
+
+# Reminder CRUD
+async def get_timers_due_for_reminder(
+    db: AsyncSession,
+    window_minutes: int,
+    window_start: datetime,
+    window_end: datetime,
+    after: Optional[Tuple[datetime, UUID]] = None,
+    limit: int = 1000
+) -> List[Row]:
+    """Return (user_id, deadline) rows with window_start < deadline <= window_end
+    that have not been reminded for this window yet.
+
+    Rows come back in (deadline, user_id) order so callers can page through a
+    window with keyset pagination by passing the last row back as ``after``.
+    """
+    query = (
+        select(Timer.user_id, Timer.deadline)
+        .where(
+            Timer.status == TimerStatus.ACTIVE,
+            Timer.deadline > window_start,
+            Timer.deadline <= window_end,
+            ~exists().where(
+                TimerReminder.user_id == Timer.user_id,
+                TimerReminder.window_minutes == window_minutes,
+                TimerReminder.deadline == Timer.deadline
+            )
+        )
+        .order_by(Timer.deadline, Timer.user_id)
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(tuple_(Timer.deadline, Timer.user_id) > tuple_(*after))
+    result = await db.execute(query)
+    return result.all()
+
+
+async def record_reminders_sent(db: AsyncSession, window_minutes: int, rows: List[Row]) -> List[Row]:
+    """Record reminders as sent and return only the rows this call claimed.
+
+    Rows already claimed by a concurrent run are skipped, so each reminder is
+    queued exactly once per (user, window, deadline).
+    """
+    if not rows:
+        return []
+    now = datetime.utcnow()
+    result = await db.execute(
+        pg_insert(TimerReminder)
+        .values([
+            {
+                "user_id": row.user_id,
+                "window_minutes": window_minutes,
+                "deadline": row.deadline,
+                "sent_at": now
+            }
+            for row in rows
+        ])
+        .on_conflict_do_nothing()
+        .returning(TimerReminder.user_id, TimerReminder.deadline)
+    )
+    claimed = result.all()
+    await db.commit()
+    return claimed
+
+
+async def delete_stale_reminders(db: AsyncSession, before: datetime) -> int:
+    """Drop reminder records for deadlines that have already passed"""
+    result = await db.execute(delete(TimerReminder).where(TimerReminder.deadline < before))
+    await db.commit()
+    return result.rowcount
+
+
+async def get_user_emails(db: AsyncSession, user_ids: List[UUID]) -> dict:
+    result = await db.execute(select(User.id, User.email).where(User.id.in_(user_ids)))
+    return {row.id: row.email for row in result}
+
+
+# Check-in History CRUD
+async def insert_checkin_events(db: AsyncSession, events: List[dict]) -> None:
+    """Insert a batch of buffered check-in events in one executemany round trip"""
+    await db.execute(insert(CheckinEvent), events)
+    await db.commit()
+
+
+async def get_checkin_history(
+    db: AsyncSession,
+    user_id: UUID,
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    limit: int = 50
+) -> List[CheckinEvent]:
+    """Check-ins newest first, keyset paged on (checked_in_at, id).
+
+    Batched writes give many events the same timestamp, so the cursor needs
+    the id as a tie breaker; before and before_id are given together or not
+    at all.
+    """
+    query = select(CheckinEvent).where(CheckinEvent.user_id == user_id)
+    if before is not None:
+        query = query.where(tuple_(CheckinEvent.checked_in_at, CheckinEvent.id) < tuple_(before, before_id))
+    result = await db.execute(
+        query.order_by(CheckinEvent.checked_in_at.desc(), CheckinEvent.id.desc()).limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def get_checkin_daily_summaries(
+    db: AsyncSession,
+    user_id: UUID,
+    before: Optional[date] = None,
+    limit: int = 30
+) -> List[CheckinDailySummary]:
+    query = select(CheckinDailySummary).where(CheckinDailySummary.user_id == user_id)
+    if before is not None:
+        query = query.where(CheckinDailySummary.day < before)
+    result = await db.execute(query.order_by(CheckinDailySummary.day.desc()).limit(limit))
+    return result.scalars().all()
+
+
+async def compact_checkin_events(db: AsyncSession, cutoff: datetime, batch_size: int) -> int:
+    """Roll one batch of events older than cutoff into daily summaries.
+
+    The delete and the summary upsert run as a single statement, so a batch is
+    either fully compacted or not at all. Returns the number of events removed.
+    """
+    batch = (
+        delete(CheckinEvent)
+        .where(
+            CheckinEvent.id.in_(
+                select(CheckinEvent.id).where(CheckinEvent.checked_in_at < cutoff).limit(batch_size)
+            )
+        )
+        .returning(CheckinEvent.user_id, CheckinEvent.checked_in_at)
+        .cte("batch")
+    )
+    day = cast(batch.c.checked_in_at, Date)
+    rollup = pg_insert(CheckinDailySummary).from_select(
+        ["user_id", "day", "checkin_count", "first_checkin", "last_checkin"],
+        select(
+            batch.c.user_id,
+            day,
+            func.count(),
+            func.min(batch.c.checked_in_at),
+            func.max(batch.c.checked_in_at)
+        ).group_by(batch.c.user_id, day)
+    )
+    upsert = rollup.on_conflict_do_update(
+        index_elements=[CheckinDailySummary.user_id, CheckinDailySummary.day],
+        set_={
+            "checkin_count": CheckinDailySummary.checkin_count + rollup.excluded.checkin_count,
+            "first_checkin": func.least(CheckinDailySummary.first_checkin, rollup.excluded.first_checkin),
+            "last_checkin": func.greatest(CheckinDailySummary.last_checkin, rollup.excluded.last_checkin),
+        }
+    )
+    rolled_up = upsert.returning(CheckinDailySummary.day).cte("rolled_up")
+    result = await db.execute(select(func.count()).select_from(batch).add_cte(rolled_up))
+    compacted = result.scalar_one()
+    await db.commit()
+    return compacted
+
+
+async def delete_old_checkin_summaries(db: AsyncSession, before: date, batch_size: int) -> int:
+    result = await db.execute(
+        delete(CheckinDailySummary).where(
+            tuple_(CheckinDailySummary.user_id, CheckinDailySummary.day).in_(
+                select(CheckinDailySummary.user_id, CheckinDailySummary.day)
+                .where(CheckinDailySummary.day < before)
+                .limit(batch_size)
+            )
+        )
+    )
+    await db.commit()
+    return result.rowcount
+
+
+# Device Token CRUD
+async def create_device_token(db: AsyncSession, user_id: UUID, token: DeviceTokenCreate) -> DeviceToken:
+    db_token = DeviceToken(user_id=user_id, name=token.name)
+    db.add(db_token)
+    await db.commit()
+    await db.refresh(db_token)
+    return db_token
+
+
+async def get_device_tokens(db: AsyncSession, user_id: UUID) -> List[DeviceToken]:
+    result = await db.execute(
+        select(DeviceToken)
+        .where(DeviceToken.user_id == user_id, DeviceToken.revoked_at.is_(None))
+        .order_by(DeviceToken.created_at)
+    )
+    return result.scalars().all()
+
+
+async def is_device_token_active(db: AsyncSession, token_id: UUID) -> bool:
+    result = await db.execute(
+        select(DeviceToken.id).where(DeviceToken.id == token_id, DeviceToken.revoked_at.is_(None))
+    )
+    return result.scalar_one_or_none() is not None
+
+
+async def device_token_exists(db: AsyncSession, token_id: UUID, user_id: UUID) -> bool:
+    """Whether the user owns this token, revoked or not"""
+    result = await db.execute(
+        select(DeviceToken.id).where(DeviceToken.id == token_id, DeviceToken.user_id == user_id)
+    )
+    return result.scalar_one_or_none() is not None
+
+
+async def revoke_device_token(db: AsyncSession, token_id: UUID, user_id: UUID) -> bool:
+    result = await db.execute(
+        update(DeviceToken)
+        .where(
+            DeviceToken.id == token_id,
+            DeviceToken.user_id == user_id,
+            DeviceToken.revoked_at.is_(None)
+        )
+        .values(revoked_at=datetime.utcnow())
+        .returning(DeviceToken.id)
+    )
+    revoked = result.scalar_one_or_none() is not None
+    await db.commit()
+    return revoked
+
+
 # Vault CRUD
-async def create_vault(db: AsyncSession, user_id: UUID, vault: VaultCreate) -> Vault:
-    db_vault = Vault(
-        user_id=user_id,
-        name=vault.name,
-        encrypted_data=vault.encrypted_data,
-        client_salt=vault.client_salt
+class QuotaExceeded(Exception):
+    """A vault write would take the user past their storage quota"""
+
+
+def stored_bytes(value: Optional[str]) -> int:
+    """Bytes a text value takes in the database (UTF-8), matching octet_length()"""
+    if value is None:
+        return 0
+    # Ciphertext is base64, so this is almost always the O(1) branch
+    return len(value) if value.isascii() else len(value.encode("utf-8"))
+
+
+async def create_vault(db: AsyncSession, user_id: UUID, vault: VaultCreate) -> Row:
+    """Insert a vault and charge it to the user's quota in one statement; raises QuotaExceeded"""
+    size = stored_bytes(vault.encrypted_data)
+    usage = (
+        update(User)
+        .where(
+            User.id == user_id,
+            User.vault_bytes_used + size <= settings.vault_quota_bytes,
+            User.vault_count < settings.vault_quota_count
+        )
+        .values(vault_bytes_used=User.vault_bytes_used + size, vault_count=User.vault_count + 1)
+        .returning(User.id)
+        .cte("usage")
     )
-    db.add(db_vault)
+    result = await db.execute(
+        insert(Vault)
+        .from_select(
+            ["id", "user_id", "name", "encrypted_data", "client_salt"],
+            select(
+                literal(uuid.uuid4(), Vault.id.type),
+                usage.c.id,
+                literal(vault.name, Vault.name.type),
+                literal(vault.encrypted_data, Vault.encrypted_data.type),
+                literal(vault.client_salt, Vault.client_salt.type)
+            )
+        )
+        .returning(*VAULT_RESPONSE_COLUMNS)
+    )
+    row = result.one_or_none()
     await db.commit()
-    await db.refresh(db_vault)
-    return db_vault
+    if row is None:
+        raise QuotaExceeded()
+    return row
 
 
 async def get_vaults(db: AsyncSession, user_id: UUID) -> List[Vault]:
-    result = await db.execute(select(Vault).where(Vault.user_id == user_id))
+    result = await db.execute(
+        select(Vault).where(Vault.user_id == user_id, Vault.deleted_at.is_(None))
+    )
     return result.scalars().all()
 
 
 async def get_vault(db: AsyncSession, vault_id: UUID, user_id: UUID) -> Optional[Vault]:
     result = await db.execute(
-        select(Vault).where(Vault.id == vault_id, Vault.user_id == user_id)
+        select(Vault).where(Vault.id == vault_id, Vault.user_id == user_id, Vault.deleted_at.is_(None))
     )
     return result.scalar_one_or_none()
 
 
-async def update_vault(db: AsyncSession, vault_id: UUID, user_id: UUID, vault: VaultUpdate) -> Optional[Vault]:
-    db_vault = await get_vault(db, vault_id, user_id)
-    if not db_vault:
-        return None
-    
-    if vault.name is not None:
-        db_vault.name = vault.name
-    if vault.encrypted_data is not None:
-        db_vault.encrypted_data = vault.encrypted_data
-    if vault.client_salt is not None:
-        db_vault.client_salt = vault.client_salt
-    
+async def get_vault_rows(db: AsyncSession, user_id: UUID) -> List[Row]:
+    result = await db.execute(
+        select(*VAULT_RESPONSE_COLUMNS).where(Vault.user_id == user_id, Vault.deleted_at.is_(None))
+    )
+    return result.all()
+
+
+async def get_vault_row(db: AsyncSession, vault_id: UUID, user_id: UUID) -> Optional[Row]:
+    result = await db.execute(
+        select(*VAULT_RESPONSE_COLUMNS).where(Vault.id == vault_id, Vault.user_id == user_id, Vault.deleted_at.is_(None))
+    )
+    return result.one_or_none()
+
+
+async def update_vault(db: AsyncSession, vault_id: UUID, user_id: UUID, vault: VaultUpdate) -> Optional[Row]:
+    """Update a vault, re-charging its quota if the ciphertext changes; raises QuotaExceeded"""
+    values = {
+        field: getattr(vault, field)
+        for field in ("name", "encrypted_data", "client_salt")
+        if getattr(vault, field) is not None
+    }
+    if not values:
+        return await get_vault_row(db, vault_id, user_id)
+
+    live_vault = (Vault.id == vault_id, Vault.user_id == user_id, Vault.deleted_at.is_(None))
+    if vault.encrypted_data is None:
+        result = await db.execute(
+            update(Vault).where(*live_vault).values(**values).returning(*VAULT_RESPONSE_COLUMNS)
+        )
+        row = result.one_or_none()
+        await db.commit()
+        return row
+
+    # Swap the old ciphertext's size for the new one in the same statement
+    change = stored_bytes(vault.encrypted_data) - func.coalesce(func.octet_length(Vault.encrypted_data), 0)
+    previous = select(Vault.id, change.label("change")).where(*live_vault).with_for_update().cte("previous")
+    usage = (
+        update(User)
+        .where(
+            User.id == user_id,
+            # Shrinking a vault is always allowed, even for a user over a lowered quota
+            or_(previous.c.change <= 0, User.vault_bytes_used + previous.c.change <= settings.vault_quota_bytes)
+        )
+        .values(vault_bytes_used=User.vault_bytes_used + previous.c.change)
+        .returning(previous.c.id)
+        .cte("usage")
+    )
+    result = await db.execute(
+        update(Vault).where(Vault.id == usage.c.id).values(**values).returning(*VAULT_RESPONSE_COLUMNS)
+    )
+    row = result.one_or_none()
     await db.commit()
-    await db.refresh(db_vault)
-    return db_vault
+    if row is None and await get_vault_row(db, vault_id, user_id) is not None:
+        raise QuotaExceeded()
+    return row
 
 
 async def delete_vault(db: AsyncSession, vault_id: UUID, user_id: UUID) -> bool:
-    db_vault = await get_vault(db, vault_id, user_id)
-    if not db_vault:
-        return False
-    
-    await db.delete(db_vault)
+    # Tombstone only; the purge task deletes the row (and its TOAST data) later.
+    # The quota is released right away, in the same statement.
+    tombstoned = (
+        update(Vault)
+        .where(Vault.id == vault_id, Vault.user_id == user_id, Vault.deleted_at.is_(None))
+        .values(deleted_at=datetime.utcnow())
+        .returning(Vault.user_id, func.coalesce(func.octet_length(Vault.encrypted_data), 0).label("size"))
+        .cte("tombstoned")
+    )
+    result = await db.execute(
+        update(User)
+        .where(User.id == tombstoned.c.user_id)
+        .values(vault_bytes_used=User.vault_bytes_used - tombstoned.c.size, vault_count=User.vault_count - 1)
+        .returning(User.id)
+    )
+    deleted = result.scalar_one_or_none() is not None
     await db.commit()
-    return True
+    return deleted
 
 
 # Beneficiary CRUD
@@ -184,7 +732,9 @@ async def create_beneficiary(db: AsyncSession, user_id: UUID, beneficiary: Benef
 
 
 async def get_beneficiaries(db: AsyncSession, user_id: UUID) -> List[Beneficiary]:
-    result = await db.execute(select(Beneficiary).where(Beneficiary.user_id == user_id))
+    result = await db.execute(
+        select(Beneficiary).where(Beneficiary.user_id == user_id, Beneficiary.deleted_at.is_(None))
+    )
     return result.scalars().all()
 
 
@@ -192,12 +742,31 @@ async def get_beneficiary(db: AsyncSession, beneficiary_id: UUID, user_id: UUID)
     result = await db.execute(
         select(Beneficiary).where(
             Beneficiary.id == beneficiary_id,
-            Beneficiary.user_id == user_id
+            Beneficiary.user_id == user_id,
+            Beneficiary.deleted_at.is_(None)
         )
     )
     return result.scalar_one_or_none()
 
 
+async def get_beneficiary_rows(db: AsyncSession, user_id: UUID) -> List[Row]:
+    result = await db.execute(
+        select(*BENEFICIARY_RESPONSE_COLUMNS).where(Beneficiary.user_id == user_id, Beneficiary.deleted_at.is_(None))
+    )
+    return result.all()
+
+
+async def get_beneficiary_row(db: AsyncSession, beneficiary_id: UUID, user_id: UUID) -> Optional[Row]:
+    result = await db.execute(
+        select(*BENEFICIARY_RESPONSE_COLUMNS).where(
+            Beneficiary.id == beneficiary_id,
+            Beneficiary.user_id == user_id,
+            Beneficiary.deleted_at.is_(None)
+        )
+    )
+    return result.one_or_none()
+
+
 async def update_beneficiary(db: AsyncSession, beneficiary_id: UUID, user_id: UUID, beneficiary: "BeneficiaryUpdate") -> Optional[Beneficiary]:
     db_beneficiary = await get_beneficiary(db, beneficiary_id, user_id)
     if not db_beneficiary:
@@ -214,10 +783,29 @@ async def update_beneficiary(db: AsyncSession, beneficiary_id: UUID, user_id: UU
 
 
 async def delete_beneficiary(db: AsyncSession, beneficiary_id: UUID, user_id: UUID) -> bool:
-    db_beneficiary = await get_beneficiary(db, beneficiary_id, user_id)
-    if not db_beneficiary:
-        return False
-    
-    await db.delete(db_beneficiary)
+    result = await db.execute(
+        update(Beneficiary)
+        .where(
+            Beneficiary.id == beneficiary_id,
+            Beneficiary.user_id == user_id,
+            Beneficiary.deleted_at.is_(None)
+        )
+        .values(deleted_at=datetime.utcnow())
+        .returning(Beneficiary.id)
+    )
+    deleted = result.scalar_one_or_none() is not None
+    await db.commit()
+    return deleted
+
+
+# Purge of tombstoned rows
+async def purge_rows(db: AsyncSession, table: Table, condition: ColumnElement, batch_size: int) -> int:
+    """Hard-delete up to batch_size rows of table matching condition, in one short transaction"""
+    key = tuple_(*table.primary_key.columns)
+    result = await db.execute(
+        delete(table).where(
+            key.in_(select(*table.primary_key.columns).where(condition).limit(batch_size))
+        )
+    )
     await db.commit()
-    return True
+    return result.rowcount
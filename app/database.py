@@ -1,27 +1,70 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import functools
+import inspect
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import declarative_base
 from app.config import settings
+from app.sharding import ShardRouter
 
-engine = create_async_engine(
-    settings.database_url,
-    echo=True,
-    future=True
+shard_router = ShardRouter(
+    [settings.database_url] + settings.shard_database_urls,
+    engine_options=dict(
+        echo=True,
+        future=True,
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout,
+    ),
 )
 
-AsyncSessionLocal = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-    autocommit=False,
-    autoflush=False,
-)
+# Shard 0: the default database, which also holds the shard directory
+engine = shard_router.engine(0)
+
+AsyncSessionLocal = shard_router.sessionmaker(0)
 
 Base = declarative_base()
 
 
-async def get_db() -> AsyncSession:
-    async with AsyncSessionLocal() as session:
+async def get_db(request: Request) -> AsyncSession:
+    # The session only checks a connection out of the pool on its first query,
+    # and FastAPI caches this dependency per request, so authentication and the
+    # handler share one session and one transaction. Requests carrying an
+    # access token get a session on that user's shard.
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    shard_id = await shard_router.shard_for_token(token if scheme.lower() == "bearer" else None)
+    async with shard_router.sessionmaker(shard_id)() as session:
         try:
             yield session
         finally:
             await session.close()
+
+
+class EarlyReleaseRoute(APIRoute):
+    """Route that returns DB connections to the pool as soon as the handler returns.
+
+    FastAPI only tears down ``get_db`` after the response has been sent, so a
+    slow client downloading a large vault would otherwise keep a pool
+    connection checked out for the whole transfer. Handler results are fully
+    loaded ORM objects (``expire_on_commit=False``), so closing the session
+    before serialization is safe. Streaming responses still need their
+    session and are left alone.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        endpoint = self.dependant.call
+        if not inspect.iscoroutinefunction(endpoint):
+            return
+
+        @functools.wraps(endpoint)
+        async def call(**values):
+            response = await endpoint(**values)
+            if not isinstance(response, StreamingResponse):
+                for value in values.values():
+                    if isinstance(value, AsyncSession):
+                        await value.close()
+            return response
+
+        self.dependant.call = call
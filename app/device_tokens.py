@@ -0,0 +1,91 @@
+"""Signed per-device heartbeat tokens.
+
+A token is ``base64url(user_id || token_id) + "." + base64url(hmac)``, signed
+with a key derived from ``SECRET_KEY``. The signature proves the user id;
+whether the token is still active comes from the database, the source of
+truth for revocations, and is cached in Redis for
+``DEVICE_TOKEN_CACHE_SECONDS`` (hours), so a check-in is normally a signature
+check plus one timer update. Revoking overwrites the cached state and fails
+if it cannot, so the caller can retry; a lost or evicted cache entry only
+means one more database lookup, so a Redis restart or flush can never bring
+a revoked token back.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+from typing import Optional, Tuple
+from uuid import UUID
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import get_redis
+from app.config import settings
+from app import crud
+
+STATE_KEY_PREFIX = "device_tokens:state:"
+ACTIVE = b"active"
+REVOKED = b"revoked"
+SIGNATURE_BYTES = 16
+
+_signing_key = hmac.new(settings.secret_key.encode(), b"device-heartbeat-token", hashlib.sha256).digest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(_signing_key, payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+def issue_token(user_id: UUID, token_id: UUID) -> str:
+    payload = user_id.bytes + token_id.bytes
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def verify_token(token: str) -> Optional[Tuple[UUID, UUID]]:
+    """Return (user_id, token_id) if the signature is valid, else None"""
+    encoded_payload, _, encoded_signature = token.partition(".")
+    try:
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except (binascii.Error, ValueError):
+        return None
+    if len(payload) != 32 or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    return UUID(bytes=payload[:16]), UUID(bytes=payload[16:])
+
+
+def _state_key(token_id: UUID) -> str:
+    return f"{STATE_KEY_PREFIX}{token_id}"
+
+
+async def is_revoked(db: AsyncSession, token_id: UUID) -> bool:
+    key = _state_key(token_id)
+    try:
+        state = await get_redis().get(key)
+    except RedisError:
+        state = None
+    if state is not None:
+        return state == REVOKED
+
+    active = await crud.is_device_token_active(db, token_id)
+    try:
+        # nx: a revocation that landed since our read has already written its state
+        await get_redis().set(key, ACTIVE if active else REVOKED, ex=settings.device_token_cache_seconds, nx=True)
+    except RedisError:
+        pass
+    return not active
+
+
+async def mark_revoked(token_id: UUID) -> None:
+    """Overwrite the cached state with "revoked"; raises RedisError if that fails.
+
+    Call after the database row is revoked. Until this succeeds, a cached
+    "active" state keeps the token working, so failures must be retried.
+    """
+    await get_redis().set(_state_key(token_id), REVOKED, ex=settings.device_token_cache_seconds)
@@ -0,0 +1,43 @@
+"""Bucketing for the expiry forecast counters.
+
+Every active timer is counted once, in the bucket its deadline falls in and
+the stripe its user id maps to. Writers describe what they did to a timer as
+``(user_id, deadline, delta)`` changes (``-1`` for the deadline it leaves,
+``+1`` for the one it gets) and ``forecast_rows`` turns them into counter
+increments, so reading the forecast is a sum over buckets, never a scan of
+``timers``.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+from uuid import UUID
+from app.config import settings
+
+# Buckets are aligned to this instant
+EPOCH = datetime(2000, 1, 1)
+
+
+def bucket_width() -> timedelta:
+    return timedelta(minutes=settings.expiry_forecast_bucket_minutes)
+
+
+def bucket_start(deadline: datetime) -> datetime:
+    width = bucket_width()
+    return EPOCH + (deadline - EPOCH) // width * width
+
+
+def stripe(user_id: UUID) -> int:
+    return user_id.int % settings.expiry_forecast_stripes
+
+
+def forecast_rows(changes: Iterable[Tuple[UUID, Optional[datetime], int]]) -> List[dict]:
+    """Net counter increments for the changes, sorted by key (a fixed lock order) with no-ops dropped"""
+    totals = defaultdict(int)
+    for user_id, deadline, delta in changes:
+        if deadline is not None:
+            totals[(bucket_start(deadline), stripe(user_id))] += delta
+    return [
+        {"bucket_start": start, "stripe": stripe_id, "expiring": delta}
+        for (start, stripe_id), delta in sorted(totals.items())
+        if delta
+    ]
@@ -1,7 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import auth, heartbeat, vault, timer, beneficiary
-from app.database import engine, Base
+from app.routers import auth, heartbeat, vault, timer, beneficiary, account, admin
+from app.compression import CompressionMiddleware
+from app.body_limit import BodySizeLimitMiddleware
+from app.config import settings
+from app.database import Base, shard_router
+from app import timer_events
+from app.checkin_history import recorder as checkin_recorder
+from app.admission import AdmissionControlMiddleware, pool_utilization
+from app.profiling import ProfilingMiddleware, profiler
 
 app = FastAPI(
     title="Dead Man's Switch API",
@@ -12,6 +19,21 @@ app = FastAPI(
     openapi_url="/openapi.json"
 )
 
+# Admission control: shed low-priority requests before they queue on the DB pool
+if settings.admission_enabled:
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        pool_pressure=lambda: max(
+            (pool_utilization(shard_engine.pool, settings.database_max_overflow) for shard_engine in shard_router.engines()),
+            default=0.0
+        ),
+        concurrency_limits=settings.admission_concurrency_limits,
+        max_queue=settings.admission_max_queue,
+        shed_pool_utilization=settings.admission_shed_pool_utilization,
+        queue_timeout=settings.admission_queue_timeout,
+        retry_after=settings.admission_retry_after_seconds,
+    )
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -21,19 +43,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Response compression (zstd/brotli/gzip, negotiated per request)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.compression_minimum_size,
+    excluded_paths=settings.compression_excluded_paths,
+    gzip_level=settings.compression_gzip_level,
+    brotli_quality=settings.compression_brotli_quality,
+    zstd_level=settings.compression_zstd_level,
+)
+
+# Sampling profiler for slow requests (opt-in, see /admin/profiles)
+if settings.profiling_enabled:
+    profiler.instrument()
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Reject oversized request bodies before they are read (outermost, so nothing
+# else does work for them)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_body_size=settings.max_request_body_bytes,
+    path_limits=[("/vaults", settings.vault_quota_bytes + settings.vault_request_overhead_bytes)],
+)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(heartbeat.router)
 app.include_router(timer.router)
 app.include_router(vault.router)
 app.include_router(beneficiary.router)
+app.include_router(account.router)
+app.include_router(admin.router)
 
 
 @app.on_event("startup")
 async def startup():
-    # Create tables (in production, use Alembic migrations)
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    for shard_id in shard_router.shard_ids:
+        # Create tables (in production, use Alembic migrations)
+        async with shard_router.engine(shard_id).begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    checkin_recorder.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await checkin_recorder.stop()
+    await timer_events.hub.close()
+    await shard_router.dispose()
 
 
 @app.get("/")
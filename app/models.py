@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Enum as SQLEnum, Boolean
+from sqlalchemy import Column, String, Integer, BigInteger, Date, DateTime, ForeignKey, Text, Enum as SQLEnum, Boolean, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -14,11 +14,18 @@ class TimerStatus(str, enum.Enum):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_deleted_at", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True, nullable=False)
+    # Storage quota counters, kept in step with every vault write
+    vault_bytes_used = Column(BigInteger, default=0, server_default="0", nullable=False)
+    vault_count = Column(Integer, default=0, server_default="0", nullable=False)
+    deleted_at = Column(DateTime, nullable=True)  # Tombstone; rows are purged in the background
 
     # Relationships
     timer = relationship("Timer", back_populates="user", uselist=False)
@@ -28,6 +35,10 @@ class User(Base):
 
 class Timer(Base):
     __tablename__ = "timers"
+    __table_args__ = (
+        # Expiry and reminder scans are range scans over active deadlines
+        Index("ix_timers_status_deadline", "status", "deadline", "user_id"),
+    )
 
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
     status = Column(SQLEnum(TimerStatus), default=TimerStatus.ACTIVE, nullable=False)
@@ -39,14 +50,72 @@ class Timer(Base):
     user = relationship("User", back_populates="timer")
 
 
+class TimerReminder(Base):
+    __tablename__ = "timer_reminders"
+    __table_args__ = (
+        Index("ix_timer_reminders_deadline", "deadline"),
+    )
+
+    # One row per (user, warning window, deadline): a check-in moves the
+    # deadline, which makes the user eligible for a fresh set of reminders.
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    window_minutes = Column(Integer, primary_key=True)
+    deadline = Column(DateTime, primary_key=True)
+    sent_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class CheckinEvent(Base):
+    __tablename__ = "checkin_events"
+    __table_args__ = (
+        # id breaks ties between events with the same timestamp when paging
+        Index("ix_checkin_events_user_time_id", "user_id", "checked_in_at", "id"),
+        # Append-only and time ordered, so a BRIN index keeps compaction
+        # range scans cheap at a tiny fraction of a btree's size
+        Index("ix_checkin_events_checked_in_at", "checked_in_at", postgresql_using="brin"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    checked_in_at = Column(DateTime, nullable=False)
+    source = Column(String, nullable=False)  # "api", "device" or "websocket"
+
+
+class CheckinDailySummary(Base):
+    __tablename__ = "checkin_daily_summaries"
+
+    # Check-in events older than the retention window are rolled up here
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    checkin_count = Column(Integer, nullable=False)
+    first_checkin = Column(DateTime, nullable=False)
+    last_checkin = Column(DateTime, nullable=False)
+
+
+class DeviceToken(Base):
+    __tablename__ = "device_tokens"
+
+    # Only the id is embedded in the signed token; the secret is never stored
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True)
+    name = Column(String, nullable=False)  # e.g. "backup-server cron"
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+
+
 class Vault(Base):
     __tablename__ = "vaults"
+    __table_args__ = (
+        # Reads only ever see live rows; the purger only ever sees tombstones
+        Index("ix_vaults_user_live", "user_id", postgresql_where=text("deleted_at IS NULL")),
+        Index("ix_vaults_deleted_at", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     name = Column(String, nullable=False)  # Name/identifier for the vault
     encrypted_data = Column(Text, nullable=True)
     client_salt = Column(String, nullable=True)
+    deleted_at = Column(DateTime, nullable=True)
 
     # Relationships
     user = relationship("User", back_populates="vaults")
@@ -54,11 +123,61 @@ class Vault(Base):
 
 class Beneficiary(Base):
     __tablename__ = "beneficiaries"
+    __table_args__ = (
+        Index("ix_beneficiaries_user_live", "user_id", postgresql_where=text("deleted_at IS NULL")),
+        Index("ix_beneficiaries_deleted_at", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     email = Column(String, nullable=False)
     name = Column(String, nullable=False)
+    deleted_at = Column(DateTime, nullable=True)
 
     # Relationships
     user = relationship("User", back_populates="beneficiaries")
+
+
+class ExpiryForecast(Base):
+    __tablename__ = "expiry_forecast"
+
+    # Active timers per deadline bucket, kept up to date by every write that
+    # moves a deadline. Each bucket is split over a few stripes (by user) so
+    # concurrent check-ins landing in the same bucket don't queue on one row.
+    bucket_start = Column(DateTime, primary_key=True)
+    stripe = Column(Integer, primary_key=True)
+    expiring = Column(BigInteger, nullable=False, default=0)
+
+
+class ShardDirectory(Base):
+    __tablename__ = "shard_directory"
+
+    # Lives on shard 0. Only users placed somewhere other than their hash ring
+    # shard (pinned before a resize, or moved) have a row, so no foreign key.
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    shard_id = Column(Integer, nullable=False)
+    moved_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class EmailDirectory(Base):
+    __tablename__ = "email_directory"
+
+    # Lives on shard 0. A unique index on users.email only covers one shard, so
+    # registration reserves the email here first; no foreign key, as the user
+    # lives on any shard.
+    email = Column(String, primary_key=True)
+    user_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Every per-user table in foreign key order, with the column holding the user id
+USER_TABLES = [
+    (User.__table__, "id"),
+    (Timer.__table__, "user_id"),
+    (TimerReminder.__table__, "user_id"),
+    (CheckinEvent.__table__, "user_id"),
+    (CheckinDailySummary.__table__, "user_id"),
+    (DeviceToken.__table__, "user_id"),
+    (Vault.__table__, "user_id"),
+    (Beneficiary.__table__, "user_id"),
+]
@@ -0,0 +1,291 @@
+"""Opt-in sampling profiler for slow requests and worker runs.
+
+While a capture is open, a background thread samples the stack of the thread
+it runs on every ``PROFILING_INTERVAL_MS`` and counts it as a folded stack
+(the input format of flamegraph.pl and speedscope), and every SQL statement
+issued in its context is recorded with its timing. Request captures only
+count samples taken while their own asyncio task, or a task started from it
+(a streamed response body runs in one), is running; worker captures count
+everything their event loop thread does.
+
+Each request is captured while profiling is enabled, but a capture is only
+kept if the request was sampled (``PROFILING_SAMPLE_RATE``) or took longer
+than ``PROFILING_SLOW_REQUEST_MS``. Kept captures go into a bounded ring
+buffer per process; worker processes push theirs to a Redis list instead, so
+the API can serve both from ``/admin/profiles``. Statement parameters are
+never recorded, since they carry ciphertext and email addresses.
+"""
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import cache
+from app.config import settings
+
+WORKER_PROFILES_KEY = "profiles:worker"
+
+# Deeper stacks are cut at the root end
+MAX_STACK_DEPTH = 128
+MAX_STATEMENT_LENGTH = 1000
+
+_current_capture: ContextVar[Optional["Capture"]] = ContextVar("profiling_capture", default=None)
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename.replace("\\", "/")
+    short = "/".join(filename.rsplit("/", 2)[-2:])
+    return f"{code.co_name} ({short}:{code.co_firstlineno})"
+
+
+def folded_stack(frame) -> str:
+    """A frame's call stack as one ``root;...;leaf`` line of a folded stack file"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class Capture:
+    """Stack samples and SQL statements for one request or worker run"""
+
+    def __init__(self, name: str, reason: str, max_statements: int, task: Optional[asyncio.Task] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.reason = reason
+        self.max_statements = max_statements
+        self.thread_id = threading.get_ident()
+        # The request's task and the tasks started from it
+        self.tasks = weakref.WeakSet([task]) if task is not None else None
+        self.loop = task.get_loop() if task is not None else None
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.kept = False
+        self.stacks = Counter()
+        self.statements = []
+        self.statement_count = 0
+        self.sql_ms = 0.0
+
+    def record_statement(self, statement: str, started: float, duration: float) -> None:
+        self.statement_count += 1
+        self.sql_ms += duration * 1000
+        if len(self.statements) < self.max_statements:
+            self.statements.append({
+                "sql": statement[:MAX_STATEMENT_LENGTH],
+                "offset_ms": round((started - self.started) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+            })
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "reason": self.reason,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "samples": sum(self.stacks.values()),
+            "statements": self.statement_count,
+            "sql_ms": round(self.sql_ms, 3),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            **self.summary(),
+            "statement_log": self.statements,
+            "stacks": dict(self.stacks),
+        }
+
+
+def to_folded(stacks: dict) -> str:
+    """Folded stack text: one ``stack count`` line per distinct stack"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def _tracking_task_factory(previous):
+    """A task factory that adds each task started inside a capture to the capture's tasks"""
+    def factory(loop, coro, **kwargs):
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        # Runs in the creating task's context, so this is the capture it belongs to
+        capture = _current_capture.get()
+        if capture is not None and capture.tasks is not None:
+            capture.tasks.add(task)
+        return task
+
+    factory.tracks_captures = True
+    return factory
+
+
+class Profiler:
+    def __init__(
+        self,
+        interval_ms: float = 10.0,
+        buffer_size: int = 50,
+        max_statements: int = 200,
+        sample_rate: float = 0.01,
+        slow_ms: float = 1000.0,
+    ):
+        self.interval = interval_ms / 1000
+        self.max_statements = max_statements
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.captures = deque(maxlen=buffer_size)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._instrumented = False
+
+    def instrument(self) -> None:
+        """Record SQL statements issued by any engine inside a capture"""
+        if self._instrumented:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        self._instrumented = True
+
+    def _track_tasks(self, loop) -> None:
+        previous = loop.get_task_factory()
+        if not getattr(previous, "tracks_captures", False):
+            loop.set_task_factory(_tracking_task_factory(previous))
+
+    def _ensure_sampler(self) -> None:
+        # Also restarts the sampler in a forked worker process, where the thread did not survive
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            stacks = {}
+            for capture in active:
+                frame = frames.get(capture.thread_id)
+                if frame is None:
+                    continue
+                if capture.tasks is not None and asyncio.current_task(capture.loop) not in capture.tasks:
+                    # The loop is running some other request (or idle)
+                    continue
+                if capture.thread_id not in stacks:
+                    stacks[capture.thread_id] = folded_stack(frame)
+                capture.stacks[stacks[capture.thread_id]] += 1
+            del frames
+
+    @contextmanager
+    def capture(self, name: str, sampled: Optional[bool] = None, slow_ms: Optional[float] = None, task_only: bool = True):
+        """Profile the enclosed block; yields the Capture, kept if sampled or slow.
+
+        With task_only, only samples taken while the current asyncio task, or
+        a task started from it, is running are counted (use False to count
+        everything the thread does).
+        """
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+        slow_ms = self.slow_ms if slow_ms is None else slow_ms
+        task = None
+        if task_only:
+            try:
+                task = asyncio.current_task()
+            except RuntimeError:
+                task = None
+        capture = Capture(name, "sampled" if sampled else "slow", self.max_statements, task)
+        if task is not None:
+            self._track_tasks(capture.loop)
+        self._ensure_sampler()
+        with self._lock:
+            self._active[capture.id] = capture
+        token = _current_capture.set(capture)
+        try:
+            yield capture
+        finally:
+            _current_capture.reset(token)
+            with self._lock:
+                self._active.pop(capture.id, None)
+            capture.duration_ms = round((time.perf_counter() - capture.started) * 1000, 3)
+            capture.kept = sampled or capture.duration_ms >= slow_ms
+            if capture.kept:
+                self.captures.append(capture)
+
+    def snapshot(self) -> List[dict]:
+        """Kept captures, newest first"""
+        return [capture.summary() for capture in reversed(self.captures)]
+
+    def find(self, capture_id: str) -> Optional[dict]:
+        for capture in self.captures:
+            if capture.id == capture_id:
+                return capture.to_dict()
+        return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_capture.get() is not None and context is not None:
+        context._profiling_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    capture = _current_capture.get()
+    started = getattr(context, "_profiling_started", None)
+    if capture is not None and started is not None:
+        capture.record_statement(statement, started, time.perf_counter() - started)
+
+
+async def store_worker_capture(capture: Capture) -> None:
+    """Push a kept worker capture onto the shared Redis list, keeping the newest N"""
+    redis = cache.get_redis()
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.lpush(WORKER_PROFILES_KEY, json.dumps(capture.to_dict()))
+        pipe.ltrim(WORKER_PROFILES_KEY, 0, settings.profiling_buffer_size - 1)
+        await pipe.execute()
+
+
+async def worker_captures() -> List[dict]:
+    """Worker captures from Redis, newest first"""
+    return [json.loads(raw) for raw in await cache.get_redis().lrange(WORKER_PROFILES_KEY, 0, -1)]
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: "Profiler", excluded_paths=("/admin/profiles",)):
+        self.app = app
+        self.profiler = profiler
+        self.excluded_paths = tuple(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_paths):
+            await self.app(scope, receive, send)
+            return
+
+        with self.profiler.capture(f"{scope['method']} {scope['path']}") as capture:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # Name by route template rather than the concrete path
+                route = scope.get("route")
+                if route is not None:
+                    capture.name = f"{scope['method']} {route.path}"
+
+
+profiler = Profiler(
+    interval_ms=settings.profiling_interval_ms,
+    buffer_size=settings.profiling_buffer_size,
+    max_statements=settings.profiling_max_statements,
+    sample_rate=settings.profiling_sample_rate,
+    slow_ms=settings.profiling_slow_request_ms,
+)
@@ -0,0 +1,193 @@
+"""Online moves of users between shards.
+
+Usage:
+    python -m app.rebalance move USER_ID SHARD_ID
+    python -m app.rebalance pin --shards NEW_SHARD_COUNT
+    python -m app.rebalance rebalance [--limit N]
+
+Growing from N to M shards:
+
+1. ``pin --shards M`` (with the old configuration) records every user whose
+   hash ring shard changes under M shards in the directory, at the shard they
+   live on today, so nothing moves when the new ring goes live.
+2. Deploy with the new ``SHARD_DATABASE_URLS`` (run migrations on the new
+   shards first).
+3. ``rebalance`` moves pinned users to their ring shard one at a time and
+   drops their directory rows.
+
+A move locks the user's rows on the source shard, copies them to the target,
+flips the directory, waits out the directory cache TTL while writes for that
+user are still blocked on the source, then deletes the source copy.
+"""
+import argparse
+import asyncio
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.config import settings
+from app import crud
+from app.database import shard_router
+from app.models import ShardDirectory, TimerStatus, User, USER_TABLES
+from app.sharding import HashRing
+
+# Surrogate keys that the target shard's sequences assign
+SKIP_COLUMNS = {"checkin_events": {"id"}}
+
+
+async def _set_directory(user_id: UUID, shard_id: int) -> None:
+    async with shard_router.sessionmaker(0)() as session:
+        if shard_router.ring.shard_for(user_id) == shard_id:
+            await session.execute(delete(ShardDirectory).where(ShardDirectory.user_id == user_id))
+        else:
+            stmt = pg_insert(ShardDirectory).values(user_id=user_id, shard_id=shard_id)
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[ShardDirectory.user_id],
+                    set_={"shard_id": stmt.excluded.shard_id, "moved_at": stmt.excluded.moved_at}
+                )
+            )
+        await session.commit()
+    shard_router.forget(user_id)
+
+
+async def move_user(user_id: UUID, target: int) -> bool:
+    """Move one user's rows to the target shard; returns False if already there"""
+    source = await shard_router.shard_for(user_id)
+    if source == target:
+        return False
+
+    async with shard_router.sessionmaker(source)() as src, shard_router.sessionmaker(target)() as dst:
+        # Clear any copy left behind by an interrupted move, and its forecast count
+        for table, column in reversed(USER_TABLES):
+            stmt = delete(table).where(table.c[column] == user_id)
+            if table.name != "timers":
+                await dst.execute(stmt)
+                continue
+            result = await dst.execute(stmt.returning(table.c.status, table.c.deadline))
+            await crud.shift_expiry_forecast(dst, [
+                (user_id, row.deadline, -1) for row in result if row.status == TimerStatus.ACTIVE
+            ])
+
+        forecast = []
+        for table, column in USER_TABLES:
+            # FOR UPDATE blocks writes to this user's rows (and, through the
+            # foreign keys on users, inserts of new ones) until the move commits
+            result = await src.execute(select(table).where(table.c[column] == user_id).with_for_update())
+            skip = SKIP_COLUMNS.get(table.name, set())
+            rows = [
+                {key: value for key, value in row.items() if key not in skip}
+                for row in result.mappings()
+            ]
+            if table.name == "users" and not rows:
+                raise ValueError(f"user {user_id} not found on shard {source}")
+            if rows:
+                await dst.execute(insert(table), rows)
+            if table.name == "timers":
+                # The timer's forecast count moves shards along with it
+                forecast = [
+                    (user_id, row["deadline"], 1) for row in rows if row["status"] == TimerStatus.ACTIVE
+                ]
+        await crud.shift_expiry_forecast(dst, forecast)
+        await dst.commit()
+
+        await _set_directory(user_id, target)
+
+        # Other processes may still route this user to the source until their
+        # directory cache entries expire; keep their writes blocked until then.
+        await asyncio.sleep(settings.shard_directory_cache_ttl_seconds)
+
+        for table, column in reversed(USER_TABLES):
+            await src.execute(delete(table).where(table.c[column] == user_id))
+        await crud.shift_expiry_forecast(src, [(user_id, deadline, -delta) for user_id, deadline, delta in forecast])
+        await src.commit()
+    return True
+
+
+async def pin_for_resize(new_shard_count: int) -> int:
+    """Pin users whose ring shard changes under new_shard_count to where they live now"""
+    new_ring = HashRing(new_shard_count, settings.shard_virtual_nodes)
+    pinned = 0
+    for shard_id in shard_router.shard_ids:
+        async with shard_router.sessionmaker(shard_id)() as session:
+            user_ids = await session.stream_scalars(select(User.id).execution_options(yield_per=5000))
+            batch = []
+            async for user_id in user_ids:
+                if new_ring.shard_for(user_id) != shard_id:
+                    batch.append({"user_id": user_id, "shard_id": shard_id})
+                if len(batch) >= 5000:
+                    pinned += await _pin(batch)
+                    batch = []
+            if batch:
+                pinned += await _pin(batch)
+    return pinned
+
+
+async def _pin(rows: list) -> int:
+    async with shard_router.sessionmaker(0)() as session:
+        # Users already in the directory were placed explicitly; leave them be
+        result = await session.execute(
+            pg_insert(ShardDirectory).values(rows).on_conflict_do_nothing().returning(ShardDirectory.user_id)
+        )
+        pinned = len(result.all())
+        await session.commit()
+    return pinned
+
+
+async def rebalance(limit: Optional[int] = None) -> int:
+    """Move directory-pinned users to their hash ring shard"""
+    moved = 0
+    after = None
+    while limit is None or moved < limit:
+        async with shard_router.sessionmaker(0)() as session:
+            query = select(ShardDirectory.user_id, ShardDirectory.shard_id).order_by(ShardDirectory.user_id).limit(1000)
+            if after is not None:
+                query = query.where(ShardDirectory.user_id > after)
+            rows = (await session.execute(query)).all()
+        if not rows:
+            break
+        after = rows[-1].user_id
+
+        for row in rows:
+            target = shard_router.ring.shard_for(row.user_id)
+            if target == row.shard_id:
+                continue
+            await move_user(row.user_id, target)
+            moved += 1
+            print(f"Moved {row.user_id}: shard {row.shard_id} -> {target}")
+            if limit is not None and moved >= limit:
+                break
+    return moved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move users between shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    move = commands.add_parser("move", help="move one user to a shard")
+    move.add_argument("user_id", type=UUID)
+    move.add_argument("shard_id", type=int)
+    pin = commands.add_parser("pin", help="pin users before changing the shard count")
+    pin.add_argument("--shards", type=int, required=True, help="shard count after the resize")
+    run = commands.add_parser("rebalance", help="move pinned users to their ring shard")
+    run.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    async def run_command():
+        try:
+            if args.command == "move":
+                if not 0 <= args.shard_id < len(shard_router.shard_ids):
+                    raise SystemExit(f"unknown shard {args.shard_id}")
+                moved = await move_user(args.user_id, args.shard_id)
+                print("Moved" if moved else "Already on that shard")
+            elif args.command == "pin":
+                print(f"Pinned {await pin_for_resize(args.shards)} users")
+            else:
+                print(f"Moved {await rebalance(args.limit)} users")
+        finally:
+            await shard_router.dispose()
+
+    asyncio.run(run_command())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime
+from enum import Enum
+from uuid import UUID
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, EarlyReleaseRoute
+from app import crud, schemas, timer_events
+from app.config import settings
+from app.dependencies import get_current_active_user
+from app.models import User
+
+router = APIRouter(prefix="/account", tags=["account"], route_class=EarlyReleaseRoute)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@router.get("/export")
+async def export_account(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream the current user's full account as NDJSON (one record per line)"""
+    async def lines():
+        async for record in crud.stream_account_records(db, current_user.id):
+            yield json.dumps(record, default=_encode) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="account.ndjson"'}
+    )
+
+
+@router.get("/usage", response_model=schemas.AccountUsageResponse)
+async def get_usage(
+    current_user: User = Depends(get_current_active_user)
+):
+    """Vault storage used by the current user against their quota"""
+    # The counters live on the user row, which authentication already loaded
+    return schemas.AccountUsageResponse(
+        vault_bytes_used=current_user.vault_bytes_used,
+        vault_bytes_quota=settings.vault_quota_bytes,
+        vault_count=current_user.vault_count,
+        vault_count_quota=settings.vault_quota_count
+    )
+
+
+@router.delete("", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_account(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Delete the current user's account; its data is purged in the background"""
+    deleted = await crud.delete_user(db, current_user.id)
+    if not deleted:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Account not found"
+        )
+    await timer_events.publish_timer_event(current_user.id, {"type": timer_events.ACCOUNT_DELETED})
+    return None
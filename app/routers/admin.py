@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from app import crud, expiry_forecast, profiling
+from app.admission import admission_controllers
+from app.compression import compression_stats
+from app.config import settings
+from app.database import shard_router
+from app.dependencies import require_admin
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+# Windows reported by the timers_expiring metric: (label, hours)
+EXPIRY_METRIC_WINDOWS = [("1h", 1), ("6h", 6), ("24h", 24), ("7d", 168)]
+
+# Rendered /admin/metrics body and when it goes stale: every scrape within
+# the TTL (and every scrape waiting on a refresh) shares one fan-out
+_metrics_cache = {"body": None, "expires": 0.0}
+_metrics_lock = asyncio.Lock()
+
+
+async def _profile(capture_id: str, source: str) -> dict:
+    if source == "worker":
+        capture = next((capture for capture in await profiling.worker_captures() if capture["id"] == capture_id), None)
+    else:
+        capture = profiling.profiler.find(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return capture
+
+
+async def _expiring_by_bucket(until: datetime) -> Dict[datetime, int]:
+    """Forecast counters summed over stripes and shards, for buckets starting before until"""
+    async def shard(shard_id: int):
+        async with shard_router.sessionmaker(shard_id)() as session:
+            return await crud.get_expiry_forecast(session, until)
+
+    totals = defaultdict(int)
+    for rows in await asyncio.gather(*(shard(shard_id) for shard_id in shard_router.shard_ids)):
+        for row in rows:
+            totals[row.bucket_start] += row.expiring
+    return totals
+
+
+@router.get("/compression")
+async def get_compression_stats():
+    """Bytes saved and CPU spent on response compression, per endpoint (this process)"""
+    return compression_stats.snapshot()
+
+
+@router.get("/admission")
+async def get_admission_stats():
+    """Per-lane concurrency, queue depth and shed counts (this process)"""
+    if not admission_controllers:
+        return {"enabled": False}
+    return {"enabled": True, **admission_controllers[-1].snapshot()}
+
+
+@router.get("/expiry-forecast")
+async def get_expiry_forecast(
+    hours: int = Query(168, ge=1, le=2160)
+):
+    """Active timers expiring per time bucket over the next `hours`, across all shards"""
+    now = datetime.utcnow()
+    current = expiry_forecast.bucket_start(now)
+    until = now + timedelta(hours=hours)
+    totals = await _expiring_by_bucket(until)
+
+    buckets = []
+    start = current
+    while start < until:
+        buckets.append({"start": start, "expiring": totals.get(start, 0)})
+        start += expiry_forecast.bucket_width()
+    return {
+        "bucket_minutes": int(expiry_forecast.bucket_width().total_seconds() // 60),
+        # Past their deadline in earlier buckets, waiting for the expiry task
+        "overdue": sum(count for start, count in totals.items() if start < current),
+        "buckets": buckets,
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expiry forecast gauges in Prometheus text format (cached for METRICS_CACHE_SECONDS)"""
+    if _metrics_cache["body"] is not None and time.monotonic() < _metrics_cache["expires"]:
+        return _metrics_cache["body"]
+    async with _metrics_lock:
+        if _metrics_cache["body"] is None or time.monotonic() >= _metrics_cache["expires"]:
+            _metrics_cache["body"] = await _render_metrics()
+            _metrics_cache["expires"] = time.monotonic() + settings.metrics_cache_seconds
+        return _metrics_cache["body"]
+
+
+async def _render_metrics() -> str:
+    now = datetime.utcnow()
+    current = expiry_forecast.bucket_start(now)
+    totals = await _expiring_by_bucket(now + timedelta(hours=max(hours for _, hours in EXPIRY_METRIC_WINDOWS)))
+
+    lines = [
+        "# HELP safekeep_timers_overdue Active timers past their deadline bucket, waiting to be triggered",
+        "# TYPE safekeep_timers_overdue gauge",
+        f"safekeep_timers_overdue {sum(count for start, count in totals.items() if start < current)}",
+        "# HELP safekeep_timers_expiring Active timers whose deadline bucket starts within the window",
+        "# TYPE safekeep_timers_expiring gauge",
+    ]
+    for label, hours in EXPIRY_METRIC_WINDOWS:
+        until = now + timedelta(hours=hours)
+        expiring = sum(count for start, count in totals.items() if current <= start < until)
+        lines.append(f'safekeep_timers_expiring{{window="{label}"}} {expiring}')
+    return "\n".join(lines) + "\n"
+
+
+@router.get("/profiles")
+async def get_profiles(
+    source: str = Query("api", pattern="^(api|worker)$")
+):
+    """Kept profiler captures, newest first: this API process's requests, or the workers' expiry runs"""
+    if source == "api":
+        return profiling.profiler.snapshot()
+    return [
+        {key: value for key, value in capture.items() if key not in ("statement_log", "stacks")}
+        for capture in await profiling.worker_captures()
+    ]
+
+
+@router.get("/profiles/{capture_id}")
+async def get_profile(
+    capture_id: str,
+    source: str = Query("api", pattern="^(api|worker)$")
+):
+    """One capture with its SQL statements and stack samples"""
+    return await _profile(capture_id, source)
+
+
+@router.get("/profiles/{capture_id}/folded", response_class=PlainTextResponse)
+async def get_profile_folded(
+    capture_id: str,
+    source: str = Query("api", pattern="^(api|worker)$")
+):
+    """One capture's stack samples as folded stacks, for flamegraph.pl or speedscope"""
+    return profiling.to_folded((await _profile(capture_id, source))["stacks"])
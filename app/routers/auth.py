@@ -1,14 +1,16 @@
+import asyncio
+import uuid
+from uuid import UUID
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.ext.asyncio import AsyncSession
 from jose import jwt
 from app.config import settings
-from app.database import get_db
+from app.database import shard_router, EarlyReleaseRoute
 from app import crud, schemas
 from app.models import User
 
-router = APIRouter(prefix="/auth", tags=["auth"])
+router = APIRouter(prefix="/auth", tags=["auth"], route_class=EarlyReleaseRoute)
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -22,35 +24,81 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
+async def find_user_by_email(email: str, include_deleted: bool = False):
+    """Look an email up on every shard in parallel; returns (shard_id, user)"""
+    async def lookup(shard_id: int):
+        async with shard_router.sessionmaker(shard_id)() as session:
+            return shard_id, await crud.get_user_by_email(session, email=email, include_deleted=include_deleted)
+
+    for shard_id, user in await asyncio.gather(*(lookup(shard_id) for shard_id in shard_router.shard_ids)):
+        if user is not None:
+            return shard_id, user
+    return None, None
+
+
+async def reclaim_orphaned_email(email: str, user_id: UUID) -> bool:
+    """Take over a reservation whose registration never created its user (e.g. it crashed in between)"""
+    async with shard_router.sessionmaker(0)() as directory:
+        reservation = await crud.get_email_reservation(directory, email)
+        if reservation is None:
+            # Released since the conflict
+            return await crud.reserve_email(directory, email, user_id)
+    if reservation.created_at > datetime.utcnow() - timedelta(seconds=settings.email_reservation_timeout_seconds):
+        # Its registration may still be running
+        return False
+    async with await shard_router.session_for(reservation.user_id) as db:
+        if await crud.get_user(db, reservation.user_id) is not None:
+            return False
+    async with shard_router.sessionmaker(0)() as directory:
+        return await crud.reclaim_email(directory, email, reservation.user_id, user_id)
+
+
 @router.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
 async def register(
-    user: schemas.UserCreate,
-    db: AsyncSession = Depends(get_db)
+    user: schemas.UserCreate
 ):
-    # Check if user already exists
-    db_user = await crud.get_user_by_email(db, email=user.email)
+    # Check if user already exists (a deleted account holds its email until purged)
+    _, db_user = await find_user_by_email(user.email, include_deleted=True)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    # Create user
-    new_user = await crud.create_user(db, user)
-    
-    # Automatically create a Timer record with default 30 days timeout
-    timer_data = schemas.TimerCreate(timeout_days=30)
-    await crud.create_timer(db, new_user.id, timer_data)
+    # Two registrations can both pass the check above on different shards;
+    # only one of them gets the email in the shard 0 directory
+    user_id = uuid.uuid4()
+    async with shard_router.sessionmaker(0)() as directory:
+        reserved = await crud.reserve_email(directory, user.email, user_id)
+    if not reserved:
+        reserved = await reclaim_orphaned_email(user.email, user_id)
+    if not reserved:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+
+    # Create user on the shard its id hashes to
+    async with await shard_router.session_for(user_id) as db:
+        try:
+            new_user = await crud.create_user(db, user, user_id=user_id)
+        except Exception:
+            async with shard_router.sessionmaker(0)() as directory:
+                await crud.release_emails(directory, [user_id])
+            raise
+        
+        # Automatically create a Timer record with default 30 days timeout
+        timer_data = schemas.TimerCreate(timeout_days=30)
+        await crud.create_timer(db, new_user.id, timer_data)
     
     return new_user
 
 
 @router.post("/login", response_model=schemas.Token)
 async def login(
-    form_data: OAuth2PasswordRequestForm = Depends(),
-    db: AsyncSession = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends()
 ):
-    user = await crud.get_user_by_email(db, email=form_data.username)
+    _, user = await find_user_by_email(form_data.username)
     if not user or not crud.verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -64,8 +112,9 @@ async def login(
             detail="Inactive user"
         )
     
+    # uid lets every later request find the user's shard without a lookup
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": str(user.id)}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
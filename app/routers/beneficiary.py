@@ -2,12 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from uuid import UUID
-from app.database import get_db
+from app.database import get_db, EarlyReleaseRoute
 from app import crud, schemas
 from app.dependencies import get_current_active_user
 from app.models import User
+from app.serialization import json_row, json_rows
 
-router = APIRouter(prefix="/beneficiaries", tags=["beneficiaries"])
+router = APIRouter(prefix="/beneficiaries", tags=["beneficiaries"], route_class=EarlyReleaseRoute)
 
 
 @router.post("", response_model=schemas.BeneficiaryResponse, status_code=status.HTTP_201_CREATED)
@@ -27,8 +28,8 @@ async def get_beneficiaries(
     db: AsyncSession = Depends(get_db)
 ):
     """Get all beneficiaries for the current user"""
-    beneficiaries = await crud.get_beneficiaries(db, current_user.id)
-    return beneficiaries
+    beneficiaries = await crud.get_beneficiary_rows(db, current_user.id)
+    return json_rows(beneficiaries)
 
 
 @router.get("/{beneficiary_id}", response_model=schemas.BeneficiaryResponse)
@@ -38,7 +39,7 @@ async def get_beneficiary(
     db: AsyncSession = Depends(get_db)
 ):
     """Get a specific beneficiary by ID"""
-    beneficiary = await crud.get_beneficiary(db, beneficiary_id, current_user.id)
+    beneficiary = await crud.get_beneficiary_row(db, beneficiary_id, current_user.id)
     
     if not beneficiary:
         raise HTTPException(
@@ -46,7 +47,7 @@ async def get_beneficiary(
             detail="Beneficiary not found"
         )
     
-    return beneficiary
+    return json_row(beneficiary)
 
 
 @router.put("/{beneficiary_id}", response_model=schemas.BeneficiaryResponse)
@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from redis.exceptions import RedisError
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_db
-from app import crud, schemas
-from app.dependencies import get_current_active_user
+from typing import List, Optional, Tuple
+from uuid import UUID
+from app.database import get_db, shard_router, EarlyReleaseRoute
+from app import crud, schemas, device_tokens, timer_events
+from app.checkin_history import recorder as checkin_recorder
+from app.dependencies import decode_access_token, get_current_active_user, get_user_from_token
 from app.models import User
 
-router = APIRouter(prefix="/heartbeat", tags=["heartbeat"])
+router = APIRouter(prefix="/heartbeat", tags=["heartbeat"], route_class=EarlyReleaseRoute)
 
 
 @router.post("", response_model=schemas.HeartbeatResponse)
@@ -21,6 +29,192 @@ async def heartbeat(
             detail="Timer not found for user"
         )
     
+    checkin_recorder.record(current_user.id, timer.last_checkin, "api")
+    await timer_events.publish_timer_event(current_user.id, timer_events.timer_event(timer))
+    return schemas.HeartbeatResponse(
+        message="Heartbeat received successfully",
+        last_checkin=timer.last_checkin,
+        deadline=timer.deadline
+    )
+
+
+async def _authenticate_socket(token: str) -> Optional[Tuple[User, int, float]]:
+    """(user, shard_id, token expiry as a Unix time) for an active user's access token"""
+    payload = decode_access_token(token)
+    if payload is None or payload.get("exp") is None:
+        return None
+    shard_id = await shard_router.shard_for_token(token)
+    async with shard_router.sessionmaker(shard_id)() as db:
+        user = await get_user_from_token(db, token)
+    if user is None or not user.is_active:
+        return None
+    return user, shard_id, float(payload["exp"])
+
+
+async def _is_user_active(shard_id: int, user_id: UUID) -> bool:
+    async with shard_router.sessionmaker(shard_id)() as db:
+        user = await crud.get_user(db, user_id)
+    return user is not None and user.is_active and user.deleted_at is None
+
+
+@router.websocket("/ws")
+async def heartbeat_socket(websocket: WebSocket, token: str):
+    """Long-lived check-in channel.
+
+    The client authenticates with its access token (``?token=``), then sends
+    ``checkin`` frames (answered with the new deadline) or ``ping`` frames.
+    Deadline changes made from other devices are pushed as they happen, so
+    clients no longer need to poll ``GET /timer``. The connection is closed
+    when the token expires unless the client sends ``auth <new token>``
+    first, and as soon as the account is deactivated or deleted.
+    """
+    session = await _authenticate_socket(token)
+    if session is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    user, shard_id, expires_at = session
+
+    await websocket.accept()
+    connection_id = uuid.uuid4().hex
+    queue = await timer_events.hub.subscribe(user.id)
+
+    async def push():
+        while True:
+            event = await queue.get()
+            if event.get("type") == timer_events.ACCOUNT_DELETED:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Account deleted")
+                return
+            if event.get("origin") == connection_id:
+                continue
+            await websocket.send_json({key: value for key, value in event.items() if key != "origin"})
+
+    pusher = asyncio.create_task(push())
+    try:
+        while True:
+            remaining = expires_at - time.time()
+            if remaining <= 0:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Access token expired")
+                break
+            try:
+                frame = await asyncio.wait_for(websocket.receive_text(), timeout=remaining)
+            except asyncio.TimeoutError:
+                continue
+            if frame.startswith("auth "):
+                # Re-authenticate with a fresh access token for the same user
+                session = await _authenticate_socket(frame[len("auth "):])
+                if session is None or session[0].id != user.id:
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid access token")
+                    break
+                expires_at = session[2]
+                await websocket.send_json({"type": "auth", "expires_at": datetime.utcfromtimestamp(expires_at).isoformat()})
+                continue
+            if frame == "ping":
+                await websocket.send_text("pong")
+                continue
+            if frame != "checkin":
+                await websocket.send_json({"type": "error", "detail": "Unknown frame"})
+                continue
+
+            async with shard_router.sessionmaker(shard_id)() as db:
+                timer = await crud.checkin_timer(db, user.id)
+            if not timer:
+                # checkin_timer only updates active users' timers
+                if not await _is_user_active(shard_id, user.id):
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Inactive user")
+                    break
+                await websocket.send_json({"type": "error", "detail": "Timer not found for user"})
+                continue
+
+            checkin_recorder.record(user.id, timer.last_checkin, "websocket")
+            event = timer_events.timer_event(timer)
+            await websocket.send_json({**event, "type": "checkin"})
+            await timer_events.publish_timer_event(user.id, {**event, "origin": connection_id})
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: receiving after the pusher closed the socket
+        pass
+    finally:
+        pusher.cancel()
+        await timer_events.hub.unsubscribe(user.id, queue)
+
+
+@router.post("/devices", response_model=schemas.DeviceTokenCreated, status_code=status.HTTP_201_CREATED)
+async def create_device_token(
+    device: schemas.DeviceTokenCreate,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Create a heartbeat token for a script or device (the token is only shown once)"""
+    db_token = await crud.create_device_token(db, current_user.id, device)
+    return schemas.DeviceTokenCreated(
+        id=db_token.id,
+        name=db_token.name,
+        created_at=db_token.created_at,
+        token=device_tokens.issue_token(current_user.id, db_token.id)
+    )
+
+
+@router.get("/devices", response_model=List[schemas.DeviceTokenResponse])
+async def get_device_tokens(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """List the current user's active device heartbeat tokens"""
+    return await crud.get_device_tokens(db, current_user.id)
+
+
+@router.delete("/devices/{token_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_device_token(
+    token_id: UUID,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Revoke a device heartbeat token (idempotent, so a failed revocation can be retried)"""
+    revoked = await crud.revoke_device_token(db, token_id, current_user.id)
+    if not revoked and not await crud.device_token_exists(db, token_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Device token not found"
+        )
+    try:
+        await device_tokens.mark_revoked(token_id)
+    except RedisError as e:
+        # The row is revoked, but a cached "active" state would keep the token
+        # working for hours; make the client retry until the cache is updated
+        print(f"Error publishing device token revocation: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Revocation not yet in effect, please retry"
+        )
+    return None
+
+
+@router.post("/{token}", response_model=schemas.HeartbeatResponse)
+async def device_heartbeat(
+    token: str
+):
+    """Check in with a device token: a signature check plus one timer update"""
+    verified = device_tokens.verify_token(token)
+    if verified is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or revoked device token"
+        )
+
+    async with await shard_router.session_for(verified[0]) as db:
+        if await device_tokens.is_revoked(db, verified[1]):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or revoked device token"
+            )
+        timer = await crud.checkin_timer(db, verified[0])
+    if not timer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Timer not found for user"
+        )
+
+    checkin_recorder.record(verified[0], timer.last_checkin, "device")
+    await timer_events.publish_timer_event(verified[0], timer_events.timer_event(timer))
     return schemas.HeartbeatResponse(
         message="Heartbeat received successfully",
         last_checkin=timer.last_checkin,
@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import date, datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_db
-from app import crud, schemas
+from typing import List, Optional
+from app.database import get_db, EarlyReleaseRoute
+from app import crud, schemas, timer_events
 from app.dependencies import get_current_active_user
 from app.models import User
 
-router = APIRouter(prefix="/timer", tags=["timer"])
+router = APIRouter(prefix="/timer", tags=["timer"], route_class=EarlyReleaseRoute)
 
 
 @router.get("", response_model=schemas.TimerResponse)
@@ -40,4 +42,33 @@ async def update_timer(
             detail="Timer not found for user"
         )
     
+    await timer_events.publish_timer_event(current_user.id, timer_events.timer_event(timer))
     return timer
+
+
+@router.get("/history", response_model=List[schemas.CheckinEventResponse])
+async def get_checkin_history(
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Recent check-ins, newest first. Pass the last event's checked_in_at and id as `before` and `before_id` for the next page."""
+    if (before is None) != (before_id is None):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="before and before_id must be given together"
+        )
+    return await crud.get_checkin_history(db, current_user.id, before=before, before_id=before_id, limit=limit)
+
+
+@router.get("/history/daily", response_model=List[schemas.CheckinDailySummaryResponse])
+async def get_checkin_daily_history(
+    before: Optional[date] = None,
+    limit: int = Query(30, ge=1, le=366),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Daily check-in summaries for history older than the retention window, newest first"""
+    return await crud.get_checkin_daily_summaries(db, current_user.id, before=before, limit=limit)
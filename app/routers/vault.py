@@ -2,12 +2,20 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from uuid import UUID
-from app.database import get_db
+from app.database import get_db, EarlyReleaseRoute
 from app import crud, schemas
 from app.dependencies import get_current_active_user
 from app.models import User
+from app.serialization import json_row, json_rows
 
-router = APIRouter(prefix="/vaults", tags=["vaults"])
+router = APIRouter(prefix="/vaults", tags=["vaults"], route_class=EarlyReleaseRoute)
+
+
+def _quota_exceeded() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail="Vault storage quota exceeded (see GET /account/usage)"
+    )
 
 
 @router.post("", response_model=schemas.VaultResponse, status_code=status.HTTP_201_CREATED)
@@ -17,8 +25,11 @@ async def create_vault(
     db: AsyncSession = Depends(get_db)
 ):
     """Create a new vault for the current user"""
-    db_vault = await crud.create_vault(db, current_user.id, vault)
-    return db_vault
+    try:
+        db_vault = await crud.create_vault(db, current_user.id, vault)
+    except crud.QuotaExceeded:
+        raise _quota_exceeded()
+    return json_row(db_vault, status_code=status.HTTP_201_CREATED)
 
 
 @router.get("", response_model=List[schemas.VaultResponse])
@@ -27,8 +38,8 @@ async def get_vaults(
     db: AsyncSession = Depends(get_db)
 ):
     """Get all vaults for the current user"""
-    vaults = await crud.get_vaults(db, current_user.id)
-    return vaults
+    vaults = await crud.get_vault_rows(db, current_user.id)
+    return json_rows(vaults)
 
 
 @router.get("/{vault_id}", response_model=schemas.VaultResponse)
@@ -38,13 +49,13 @@ async def get_vault(
     db: AsyncSession = Depends(get_db)
 ):
     """Get a specific vault by ID"""
-    vault = await crud.get_vault(db, vault_id, current_user.id)
+    vault = await crud.get_vault_row(db, vault_id, current_user.id)
     if not vault:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Vault not found"
         )
-    return vault
+    return json_row(vault)
 
 
 @router.put("/{vault_id}", response_model=schemas.VaultResponse)
@@ -55,13 +66,16 @@ async def update_vault(
     db: AsyncSession = Depends(get_db)
 ):
     """Update a vault"""
-    db_vault = await crud.update_vault(db, vault_id, current_user.id, vault)
+    try:
+        db_vault = await crud.update_vault(db, vault_id, current_user.id, vault)
+    except crud.QuotaExceeded:
+        raise _quota_exceeded()
     if not db_vault:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Vault not found"
         )
-    return db_vault
+    return json_row(db_vault)
 
 
 @router.delete("/{vault_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional
 from uuid import UUID
 from app.models import TimerStatus
@@ -79,6 +79,13 @@ class VaultResponse(BaseModel):
         from_attributes = True
 
 
+class AccountUsageResponse(BaseModel):
+    vault_bytes_used: int
+    vault_bytes_quota: int
+    vault_count: int
+    vault_count_quota: int
+
+
 # Beneficiary Schemas
 class BeneficiaryCreate(BaseModel):
     email: EmailStr
@@ -100,3 +107,41 @@ class HeartbeatResponse(BaseModel):
     message: str
     last_checkin: datetime
     deadline: datetime
+
+
+# Device Token Schemas
+class DeviceTokenCreate(BaseModel):
+    name: str
+
+
+class DeviceTokenResponse(BaseModel):
+    id: UUID
+    name: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class DeviceTokenCreated(DeviceTokenResponse):
+    token: str  # Only returned once, at creation
+
+
+# Check-in History Schemas
+class CheckinEventResponse(BaseModel):
+    id: int
+    checked_in_at: datetime
+    source: str
+
+    class Config:
+        from_attributes = True
+
+
+class CheckinDailySummaryResponse(BaseModel):
+    day: date
+    checkin_count: int
+    first_checkin: datetime
+    last_checkin: datetime
+
+    class Config:
+        from_attributes = True
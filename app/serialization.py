@@ -0,0 +1,26 @@
+"""JSON responses built directly from database rows.
+
+Read endpoints select only their response model's columns and pass the rows
+to ``json_rows``/``json_row``. orjson encodes the row values (UUIDs,
+datetimes, enums, strings) natively in one pass, so no Pydantic model is
+built or validated per row and large ciphertext strings are copied once,
+straight into the response body. The routes keep ``response_model`` for the
+OpenAPI schema; FastAPI sends a returned ``Response`` as is.
+"""
+from typing import Iterable, Type
+import orjson
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+
+def response_columns(model, schema: Type[BaseModel]) -> tuple:
+    """The model's columns for the schema's fields, in the schema's field order"""
+    return tuple(getattr(model, name) for name in schema.model_fields)
+
+
+def json_rows(rows: Iterable, status_code: int = 200) -> Response:
+    return Response(orjson.dumps([row._asdict() for row in rows]), status_code=status_code, media_type="application/json")
+
+
+def json_row(row, status_code: int = 200) -> Response:
+    return Response(orjson.dumps(row._asdict()), status_code=status_code, media_type="application/json")
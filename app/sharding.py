@@ -0,0 +1,125 @@
+"""Routing of per-user data to one of N Postgres databases.
+
+Shard 0 is ``DATABASE_URL`` and also holds the ``shard_directory`` table;
+``SHARD_DATABASE_URLS`` adds shards 1..N-1. A user's shard is their entry in
+the directory if they have been moved, otherwise their position on a
+consistent hash ring of the user id, so adding a shard only remaps ~1/N of
+the users (see ``app.rebalance`` for pinning and moving them online).
+
+With a single shard configured every lookup short-circuits to shard 0, so
+there is no hashing or directory query.
+"""
+import bisect
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from uuid import UUID
+from jose import JWTError, jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from app.config import settings
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.md5(data).digest()[:8], "big")
+
+
+def token_user_id(token: str) -> Optional[UUID]:
+    """User id carried in an access token's ``uid`` claim, if the token is valid"""
+    try:
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+        return UUID(payload["uid"])
+    except (JWTError, KeyError, ValueError, TypeError):
+        return None
+
+
+class HashRing:
+    def __init__(self, shard_count: int, virtual_nodes: int):
+        points = sorted(
+            (_hash(f"shard-{shard_id}-vnode-{vnode}".encode()), shard_id)
+            for shard_id in range(shard_count)
+            for vnode in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard_id for _, shard_id in points]
+
+    def shard_for(self, user_id: UUID) -> int:
+        index = bisect.bisect(self._hashes, _hash(user_id.bytes)) % len(self._hashes)
+        return self._shards[index]
+
+
+class ShardRouter:
+    def __init__(self, urls: List[str], engine_options: Optional[dict] = None):
+        self.urls = urls
+        self.engine_options = engine_options or {}
+        self.ring = HashRing(len(urls), settings.shard_virtual_nodes)
+        self._engines: Dict[int, AsyncEngine] = {}
+        self._sessionmakers: Dict[int, async_sessionmaker] = {}
+        self._directory_cache: "OrderedDict[UUID, tuple]" = OrderedDict()
+
+    @property
+    def shard_ids(self) -> List[int]:
+        return list(range(len(self.urls)))
+
+    def engine(self, shard_id: int) -> AsyncEngine:
+        if shard_id not in self._engines:
+            self._engines[shard_id] = create_async_engine(self.urls[shard_id], **self.engine_options)
+        return self._engines[shard_id]
+
+    def engines(self) -> List[AsyncEngine]:
+        """Engines created so far (engines are created on first use)"""
+        return list(self._engines.values())
+
+    def sessionmaker(self, shard_id: int) -> async_sessionmaker:
+        if shard_id not in self._sessionmakers:
+            self._sessionmakers[shard_id] = async_sessionmaker(
+                self.engine(shard_id),
+                class_=AsyncSession,
+                expire_on_commit=False,
+                autocommit=False,
+                autoflush=False,
+            )
+        return self._sessionmakers[shard_id]
+
+    async def shard_for(self, user_id: UUID) -> int:
+        if len(self.urls) == 1:
+            return 0
+
+        cached = self._directory_cache.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self._directory_cache.move_to_end(user_id)
+            return cached[0]
+
+        # Imported here: the models import app.database, which builds the router
+        from app.models import ShardDirectory
+
+        async with self.sessionmaker(0)() as session:
+            result = await session.execute(
+                select(ShardDirectory.shard_id).where(ShardDirectory.user_id == user_id)
+            )
+            shard_id = result.scalar_one_or_none()
+        if shard_id is None:
+            shard_id = self.ring.shard_for(user_id)
+
+        self._directory_cache[user_id] = (shard_id, time.monotonic() + settings.shard_directory_cache_ttl_seconds)
+        self._directory_cache.move_to_end(user_id)
+        if len(self._directory_cache) > settings.shard_directory_cache_size:
+            self._directory_cache.popitem(last=False)
+        return shard_id
+
+    def forget(self, user_id: UUID) -> None:
+        self._directory_cache.pop(user_id, None)
+
+    async def session_for(self, user_id: UUID) -> AsyncSession:
+        return self.sessionmaker(await self.shard_for(user_id))()
+
+    async def shard_for_token(self, token: Optional[str]) -> int:
+        if len(self.urls) == 1 or not token:
+            return 0
+        user_id = token_user_id(token)
+        return await self.shard_for(user_id) if user_id is not None else 0
+
+    async def dispose(self) -> None:
+        for engine in self._engines.values():
+            await engine.dispose()
@@ -0,0 +1,111 @@
+"""Timer deadline change notifications over Redis pub/sub.
+
+Every deadline change is published on ``timer:{user_id}``. Each API process
+keeps a single Redis pub/sub connection and subscribes to a user's channel
+only while that user has at least one open WebSocket on the process, so idle
+connections cost one queue each and no Redis or database connections.
+"""
+import asyncio
+import json
+from collections import defaultdict
+from typing import Dict, Optional, Set
+from uuid import UUID
+from redis.exceptions import RedisError
+from app.cache import get_redis
+
+CHANNEL_PREFIX = "timer:"
+
+
+def _channel(user_id) -> str:
+    return f"{CHANNEL_PREFIX}{user_id}"
+
+
+# Published when an account is deleted, so its open sockets close
+ACCOUNT_DELETED = "account_deleted"
+
+
+def timer_event(timer) -> dict:
+    """Build a deadline event from a Timer (or a row with the same fields)"""
+    event = {
+        "type": "deadline",
+        "last_checkin": timer.last_checkin.isoformat(),
+        "deadline": timer.deadline.isoformat(),
+    }
+    status = getattr(timer, "status", None)
+    if status is not None:
+        event["status"] = status.value
+    return event
+
+
+async def publish_timer_event(user_id: UUID, event: dict) -> None:
+    # Pushes are best effort: a Redis outage must never fail a check-in
+    try:
+        await get_redis().publish(_channel(user_id), json.dumps(event))
+    except RedisError as e:
+        print(f"Error publishing timer event: {e}")
+
+
+class TimerEventHub:
+    """Fans Redis timer events out to the WebSockets open on this process"""
+
+    def __init__(self):
+        self._queues: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def subscribe(self, user_id: UUID) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=16)
+        key = str(user_id)
+        first = not self._queues[key]
+        self._queues[key].add(queue)
+        if self._pubsub is None:
+            self._pubsub = get_redis().pubsub()
+        if first:
+            try:
+                await self._pubsub.subscribe(_channel(key))
+            except RedisError as e:
+                # Check-ins still work, the socket just won't get pushes
+                print(f"Error subscribing to timer events: {e}")
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return queue
+
+    async def unsubscribe(self, user_id: UUID, queue: asyncio.Queue) -> None:
+        key = str(user_id)
+        self._queues[key].discard(queue)
+        if not self._queues[key]:
+            del self._queues[key]
+            try:
+                await self._pubsub.unsubscribe(_channel(key))
+            except RedisError:
+                pass
+
+    async def _listen(self) -> None:
+        while self._queues:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except (RedisError, RuntimeError) as e:
+                # RuntimeError: no subscription succeeded yet
+                print(f"Error reading timer events: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+
+            user_id = message["channel"].decode()[len(CHANNEL_PREFIX):]
+            event = json.loads(message["data"])
+            for queue in list(self._queues.get(user_id, ())):
+                if queue.full():
+                    # Slow consumer: only the latest deadline matters
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+
+hub = TimerEventHub()
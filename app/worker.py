@@ -1,8 +1,24 @@
-from celery import Celery
+"""Celery app and tasks.
+
+Tasks are thin wrappers that hand a coroutine to the process's async
+runtime: one event loop per worker process, running on a background thread
+for the life of the process. The loop, the shard engines and the Redis client
+are created after fork (``worker_process_init``), so a prefork child never
+touches connections inherited from the parent, and pooled connections are
+reused from task to task instead of being opened per task. With
+``--pool threads`` every task thread of a process submits to the same loop,
+so many tasks run concurrently over one connection pool.
+"""
+import threading
+from celery import Celery, signals
 from celery.schedules import crontab
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import select
 from app.config import settings
-from app import crud
+from app import cache, crud, expiry_forecast, profiling, timer_events
+from app.models import User, Vault, Beneficiary, USER_TABLES
+from app.sharding import ShardRouter
+from datetime import datetime, timedelta
+from uuid import UUID
 import asyncio
 
 # Create Celery app
@@ -20,22 +36,33 @@ celery_app.conf.update(
     enable_utc=True,
 )
 
-# Create async database engine for Celery tasks
-_engine = None
-_async_session_maker = None
+# Shard router with its own async engines for Celery tasks
+_shard_router = None
+
+
+def get_shard_router() -> ShardRouter:
+    global _shard_router
+    if _shard_router is None:
+        _shard_router = ShardRouter(
+            [settings.database_url] + settings.shard_database_urls,
+            engine_options={
+                "echo": False,
+                "pool_size": settings.database_pool_size,
+                "max_overflow": settings.database_max_overflow,
+                "pool_timeout": settings.database_pool_timeout,
+            }
+        )
+    return _shard_router
 
 
-def get_engine():
-    global _engine, _async_session_maker
-    if _engine is None:
-        _engine = create_async_engine(settings.database_url, echo=False)
-        _async_session_maker = async_sessionmaker(_engine, expire_on_commit=False)
-    return _async_session_maker
+async def for_each_shard(process):
+    """Run process(shard_id) on every shard concurrently"""
+    await asyncio.gather(*(process(shard_id) for shard_id in get_shard_router().shard_ids))
 
 
-async def process_expired_timers():
+async def process_expired_timers(shard_id: int = 0):
     """Async function to process expired timers"""
-    async_session_maker = get_engine()
+    async_session_maker = get_shard_router().sessionmaker(shard_id)
     async with async_session_maker() as session:
         try:
             # Get all expired timers
@@ -60,7 +87,10 @@ async def process_expired_timers():
                     print(f"Sending Email to [{beneficiary.email}] with vaults data: {vault_data}")
                 
                 # Mark timer as triggered
-                await crud.mark_timer_triggered(session, timer.user_id)
+                triggered = await crud.mark_timer_triggered(session, timer.user_id)
+                if triggered:
+                    # mark_timer_triggered has committed this timer, so a later failure cannot undo it
+                    await timer_events.publish_timer_event(timer.user_id, timer_events.timer_event(triggered))
             
             await session.commit()
         except Exception as e:
@@ -68,21 +98,275 @@ async def process_expired_timers():
             await session.rollback()
             raise
 
+        # Past buckets empty out as their timers trigger; drop their counters
+        await crud.prune_expiry_forecast(session, expiry_forecast.bucket_start(datetime.utcnow()))
+
+
+async def run_expiry_check():
+    """Process expired timers on every shard, profiled when profiling is enabled"""
+    if not settings.profiling_enabled:
+        await for_each_shard(process_expired_timers)
+        return
+    profiling.profiler.instrument()
+    # The shards are processed in tasks of their own, so sample the whole loop thread
+    with profiling.profiler.capture(
+        "check_expired_timers", slow_ms=settings.profiling_slow_task_ms, task_only=False
+    ) as capture:
+        await for_each_shard(process_expired_timers)
+    if capture.kept:
+        try:
+            await profiling.store_worker_capture(capture)
+        except Exception as e:
+            print(f"Error storing expiry run profile: {e}")
+
+
+async def process_timer_reminders(shard_id: int = 0):
+    """Async function to queue reminders for timers approaching their deadline
+
+    Each warning window is scanned as a bounded deadline range over the
+    (status, deadline) index, in keyset-paginated batches, so memory use is
+    capped by ``reminder_batch_size`` regardless of how many timers match.
+    """
+    async_session_maker = get_shard_router().sessionmaker(shard_id)
+    now = datetime.utcnow()
+    batch_size = settings.reminder_batch_size
+    async with async_session_maker() as session:
+        # A timer only falls into the tightest window it has reached, so a user
+        # who is 30 minutes from their deadline gets the 1 hour reminder only.
+        lower = 0
+        for window in sorted(settings.reminder_windows_minutes):
+            window_start = now + timedelta(minutes=lower)
+            window_end = now + timedelta(minutes=window)
+            after = None
+            while True:
+                rows = await crud.get_timers_due_for_reminder(
+                    session, window, window_start, window_end, after=after, limit=batch_size
+                )
+                if not rows:
+                    break
+                after = (rows[-1].deadline, rows[-1].user_id)
+
+                claimed = await crud.record_reminders_sent(session, window, rows)
+                if claimed:
+                    send_timer_reminders.delay(
+                        [[str(row.user_id), row.deadline.isoformat()] for row in claimed],
+                        window,
+                        shard_id
+                    )
+
+                if len(rows) < batch_size:
+                    break
+            lower = window
+
+        await crud.delete_stale_reminders(session, now)
+
+
+async def deliver_timer_reminders(reminders, window_minutes, shard_id=0):
+    """Async function to send a batch of reminders"""
+    async_session_maker = get_shard_router().sessionmaker(shard_id)
+    async with async_session_maker() as session:
+        emails = await crud.get_user_emails(session, [UUID(user_id) for user_id, _ in reminders])
+    for user_id, deadline in reminders:
+        email = emails.get(UUID(user_id))
+        if email is None:
+            continue
+        print(f"Sending Reminder to [{email}]: check in before {deadline} ({window_minutes} minute warning)")
+
+
+async def compact_checkin_history(shard_id: int = 0):
+    """Async function to roll old check-in events into daily summaries, in batches"""
+    async_session_maker = get_shard_router().sessionmaker(shard_id)
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    event_cutoff = today - timedelta(days=settings.checkin_history_retention_days)
+    summary_cutoff = (today - timedelta(days=settings.checkin_summary_retention_days)).date()
+    batch_size = settings.checkin_compaction_batch_size
+    async with async_session_maker() as session:
+        compacted = 0
+        while True:
+            count = await crud.compact_checkin_events(session, event_cutoff, batch_size)
+            compacted += count
+            if count < batch_size:
+                break
+
+        purged = 0
+        while True:
+            count = await crud.delete_old_checkin_summaries(session, summary_cutoff, batch_size)
+            purged += count
+            if count < batch_size:
+                break
+    print(f"Shard {shard_id}: compacted {compacted} check-in events, purged {purged} daily summaries")
+
+
+async def purge_deleted_rows(shard_id: int = 0):
+    """Async function to hard-delete soft-deleted rows in small, throttled batches
+
+    Tombstoned vaults and beneficiaries go first, then every row belonging to
+    a deleted account, then the account itself once nothing references it.
+    Each batch is its own short transaction, with a pause in between, and a
+    run stops after ``purge_max_batches_per_run`` batches; the next run picks
+    up where it left off.
+    """
+    async_session_maker = get_shard_router().sessionmaker(shard_id)
+    batch_size = settings.purge_batch_size
+    budget = settings.purge_max_batches_per_run
+    purged = 0
+
+    async with async_session_maker() as session:
+        async def drain(table, condition) -> bool:
+            """Delete matching rows until none are left (True) or the budget runs out"""
+            nonlocal budget, purged
+            while budget > 0:
+                count = await crud.purge_rows(session, table, condition, batch_size)
+                budget -= 1
+                purged += count
+                if count < batch_size:
+                    return True
+                await asyncio.sleep(settings.purge_batch_pause_seconds)
+            return False
+
+        done = await drain(Vault.__table__, Vault.deleted_at.is_not(None))
+        done = await drain(Beneficiary.__table__, Beneficiary.deleted_at.is_not(None)) and done
+
+        deleted_users = select(User.id).where(User.deleted_at.is_not(None))
+        for table, column in reversed(USER_TABLES[1:]):
+            done = await drain(table, table.c[column].in_(deleted_users)) and done
+        while done and budget > 0:
+            user_ids = await crud.get_deleted_user_ids(session, batch_size)
+            budget -= 1
+            if user_ids:
+                # Free the emails before the accounts go: if this stops in
+                # between, the tombstones still block re-registration
+                async with get_shard_router().sessionmaker(0)() as directory:
+                    await crud.release_emails(directory, user_ids)
+                purged += await crud.purge_rows(session, User.__table__, User.id.in_(user_ids), batch_size)
+            if len(user_ids) < batch_size:
+                break
+            await asyncio.sleep(settings.purge_batch_pause_seconds)
+    print(f"Shard {shard_id}: purged {purged} deleted rows")
+
+
+class AsyncRuntime:
+    """A long-lived event loop on a background thread"""
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self._run, args=(loop,), name="worker-asyncio", daemon=True)
+            thread.start()
+            self.loop, self._thread = loop, thread
+
+    @staticmethod
+    def _run(loop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def run(self, coro):
+        """Run a coroutine on the loop and block the calling thread until it finishes"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self.loop is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+            self.loop, self._thread = None, None
+
+
+_runtime = AsyncRuntime()
+
+
+async def rebuild_expiry_forecast(shard_id: int = 0):
+    """Async function to recount a shard's expiry forecast from its timers"""
+    async_session_maker = get_shard_router().sessionmaker(shard_id)
+    async with async_session_maker() as session:
+        active = await crud.rebuild_expiry_forecast(session)
+    print(f"Shard {shard_id}: rebuilt expiry forecast for {active} active timers")
+
+
+def run_async(coro):
+    """Run a coroutine to completion on this process's event loop"""
+    return _runtime.run(coro)
+
+
+@signals.worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Start a fresh runtime in a forked child, leaving the parent's connections alone"""
+    global _runtime, _shard_router
+    if _shard_router is not None:
+        # close=False drops the inherited pools without closing sockets the parent still uses
+        for engine in _shard_router.engines():
+            engine.sync_engine.dispose(close=False)
+        _shard_router = None
+    cache.reset_redis()
+    # The parent's loop thread did not survive the fork
+    _runtime = AsyncRuntime()
+    _runtime.start()
+
+
+async def _close_connections():
+    global _shard_router
+    if _shard_router is not None:
+        await _shard_router.dispose()
+        _shard_router = None
+    await cache.close_redis()
+
+
+@signals.worker_process_shutdown.connect
+@signals.worker_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    """Close pooled connections on the runtime's loop, then stop it"""
+    if _runtime.loop is not None:
+        try:
+            _runtime.run(_close_connections())
+        except Exception as e:
+            print(f"Error closing worker connections: {e}")
+    _runtime.stop()
+
 
 @celery_app.task
 def check_expired_timers():
     """Celery task wrapper for async function"""
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    if loop.is_closed():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    loop.run_until_complete(process_expired_timers())
+    run_async(run_expiry_check())
+
+
+@celery_app.task
+def check_timer_reminders():
+    """Celery task wrapper for async function"""
+    run_async(for_each_shard(process_timer_reminders))
+
+
+@celery_app.task
+def compact_checkins():
+    """Celery task wrapper for async function"""
+    run_async(for_each_shard(compact_checkin_history))
+
+
+@celery_app.task
+def purge_deleted():
+    """Celery task wrapper for async function"""
+    run_async(for_each_shard(purge_deleted_rows))
+
+
+@celery_app.task
+def rebuild_expiry_forecasts():
+    """Celery task wrapper for async function (run by hand; not scheduled)"""
+    run_async(for_each_shard(rebuild_expiry_forecast))
+
+
+@celery_app.task
+def send_timer_reminders(reminders, window_minutes, shard_id=0):
+    """Send reminders for a batch of [user_id, deadline] pairs from one shard"""
+    run_async(deliver_timer_reminders(reminders, window_minutes, shard_id))
 
 
 # Configure periodic task to run every hour
@@ -91,4 +375,16 @@ celery_app.conf.beat_schedule = {
         "task": "app.worker.check_expired_timers",
         "schedule": crontab(minute=0),  # Run at the start of every hour
     },
+    "check-timer-reminders": {
+        "task": "app.worker.check_timer_reminders",
+        "schedule": timedelta(minutes=settings.reminder_check_interval_minutes),
+    },
+    "compact-checkins": {
+        "task": "app.worker.compact_checkins",
+        "schedule": crontab(minute=30, hour=3),  # Run daily at 03:30 UTC
+    },
+    "purge-deleted": {
+        "task": "app.worker.purge_deleted",
+        "schedule": timedelta(minutes=settings.purge_interval_minutes),
+    },
 }
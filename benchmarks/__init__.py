@@ -0,0 +1 @@
+"""Benchmarks for the API's hot paths (see ``python -m benchmarks.run --help``)."""
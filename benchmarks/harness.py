@@ -0,0 +1,105 @@
+"""Timing, result files and baseline comparison shared by the benchmarks."""
+import asyncio
+import inspect
+import json
+import platform
+import statistics
+import time
+from importlib import metadata
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+# Packages whose upgrades the benchmarks are meant to catch
+TRACKED_PACKAGES = ["sqlalchemy", "asyncpg", "pydantic", "fastapi", "passlib", "argon2-cffi", "python-jose"]
+
+
+def _summary(samples: List[float], cpu_samples: List[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "iterations": len(samples),
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000,
+        "min_ms": samples[0] * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        # Process CPU time per call; below wall time when the call waits on I/O
+        "cpu_mean_ms": statistics.fmean(cpu_samples) * 1000,
+    }
+
+
+async def measure(
+    func: Callable[[], Union[Awaitable, object]],
+    iterations: int,
+    warmup: int = 3,
+    setup: Optional[Callable[[], Union[Awaitable, object]]] = None,
+) -> dict:
+    """Time func (sync or async) per call; setup runs untimed before each call"""
+    async def call(target):
+        result = target()
+        if inspect.isawaitable(result):
+            await result
+
+    samples, cpu_samples = [], []
+    for i in range(warmup + iterations):
+        if setup is not None:
+            await call(setup)
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        await call(func)
+        elapsed = time.perf_counter() - started
+        cpu_elapsed = time.process_time() - cpu_started
+        if i >= warmup:
+            samples.append(elapsed)
+            cpu_samples.append(cpu_elapsed)
+        # Let background work (pool resets, GC of finished tasks) settle between calls
+        await asyncio.sleep(0)
+    return _summary(samples, cpu_samples)
+
+
+def environment() -> dict:
+    versions = {}
+    for package in TRACKED_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "packages": versions,
+    }
+
+
+def write_results(path: str, results: Dict[str, dict]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_results(path: str) -> Dict[str, dict]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Names (with detail) of benchmarks whose median regressed by more than threshold"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result["median_ms"] / base["median_ms"] if base["median_ms"] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{name}: {result['median_ms']:.3f} ms vs {base['median_ms']:.3f} ms baseline (+{(ratio - 1) * 100:.0f}%)"
+            )
+    return regressions
+
+
+def print_table(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None) -> None:
+    print(f"{'benchmark':<48} {'median ms':>11} {'p95 ms':>11} {'cpu ms':>11} {'vs base':>9}")
+    for name, result in sorted(results.items()):
+        change = ""
+        if baseline and name in baseline and baseline[name]["median_ms"]:
+            change = f"{(result['median_ms'] / baseline[name]['median_ms'] - 1) * 100:+.0f}%"
+        cpu = result.get("cpu_mean_ms")
+        cpu = f"{cpu:>11.3f}" if cpu is not None else f"{'':>11}"
+        print(f"{name:<48} {result['median_ms']:>11.3f} {result['p95_ms']:>11.3f} {cpu} {change:>9}")
@@ -0,0 +1,364 @@
+"""End-to-end load generator for a running stack (e.g. ``docker compose up``).
+
+Usage:
+    python -m benchmarks.load [--base-url http://localhost:8000] [--users 200]
+                              [--rps 100] [--duration 60]
+                              [--mix heartbeat=50,timer_read=25,vault_read=10,vault_write=10,beneficiary_edit=5]
+                              [--database-url URL] [--shard-database-url URL ...]
+                              [--redis-url URL] [--output report.json]
+
+1. Registers ``--users`` synthetic users through ``/auth/register``, logs them
+   in and gives each one a vault and a beneficiary.
+2. Sends the request mix at ``--rps`` (open loop: requests are started on
+   schedule whether or not earlier ones have finished, up to
+   ``--max-in-flight``) for ``--duration`` seconds.
+3. Meanwhile, ``--expire-at`` seconds in, pushes the deadlines of a separate
+   cohort of ``--expire-users`` users into the past and enqueues
+   ``check_expired_timers``; each timer's trigger lag is the time from the
+   forced expiry to its ``TRIGGERED`` event on Redis. The deadlines are moved
+   through the expiry forecast like any other deadline change, and on every
+   shard given (``--database-url`` plus each ``--shard-database-url``); on a
+   sharded stack, cohort users on a shard that is not given are not expired.
+4. Samples shard 0's connections from ``pg_stat_activity`` every second.
+
+The database and Redis are only needed for steps 3 and 4; without
+``--database-url`` both are skipped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+PASSWORD = "load-test-password"
+DEFAULT_MIX = "heartbeat=50,timer_read=25,vault_read=10,vault_write=10,beneficiary_edit=5"
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (known: {', '.join(OPERATIONS)})")
+        mix[name] = float(weight)
+    return mix
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+def latency_summary(values: List[float]) -> dict:
+    """Percentiles in milliseconds"""
+    return {
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p90_ms": percentile(values, 0.90) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": max(values) * 1000 if values else 0.0,
+        "mean_ms": statistics.fmean(values) * 1000 if values else 0.0,
+    }
+
+
+class SyntheticUser:
+    def __init__(self, email: str):
+        self.email = email
+        self.headers: Dict[str, str] = {}
+        self.user_id: Optional[str] = None
+        self.vault_id: Optional[str] = None
+        self.beneficiary_id: Optional[str] = None
+
+
+async def setup_user(client: httpx.AsyncClient, user: SyntheticUser, vault_bytes: int) -> None:
+    response = await client.post("/auth/register", json={"email": user.email, "password": PASSWORD})
+    response.raise_for_status()
+    user.user_id = response.json()["id"]
+
+    response = await client.post("/auth/login", data={"username": user.email, "password": PASSWORD})
+    response.raise_for_status()
+    user.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = await client.post("/vaults", headers=user.headers, json={
+        "name": "load-test", "encrypted_data": _ciphertext(vault_bytes), "client_salt": "c2FsdA=="
+    })
+    response.raise_for_status()
+    user.vault_id = response.json()["id"]
+
+    response = await client.post("/beneficiaries", headers=user.headers, json={
+        "email": f"beneficiary+{user.user_id}@example.com", "name": "Load Test"
+    })
+    response.raise_for_status()
+    user.beneficiary_id = response.json()["id"]
+
+
+def _ciphertext(size: int) -> str:
+    return ("QUJDRA" * (size // 6 + 1))[:size]
+
+
+# Each operation returns the request to send: (endpoint label, method, path, request kwargs)
+OPERATIONS = {
+    "heartbeat": lambda user, args: ("POST /heartbeat", "POST", "/heartbeat", {}),
+    "timer_read": lambda user, args: ("GET /timer", "GET", "/timer", {}),
+    "vault_read": lambda user, args: ("GET /vaults", "GET", "/vaults", {}),
+    "vault_write": lambda user, args: (
+        "PUT /vaults/{vault_id}", "PUT", f"/vaults/{user.vault_id}",
+        {"json": {"encrypted_data": _ciphertext(args.vault_bytes)}}
+    ),
+    "beneficiary_edit": lambda user, args: (
+        "PUT /beneficiaries/{beneficiary_id}", "PUT", f"/beneficiaries/{user.beneficiary_id}",
+        {"json": {"name": f"Load Test {random.randint(0, 10**6)}"}}
+    ),
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.skipped = 0
+
+    async def send(self, client: httpx.AsyncClient, user: SyntheticUser, operation, args) -> None:
+        label, method, path, kwargs = operation(user, args)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, headers=user.headers, **kwargs)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.latencies[label].append(time.perf_counter() - started)
+        self.statuses[label][status] += 1
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            label: {
+                "requests": len(values),
+                "throughput_rps": len(values) / elapsed,
+                "statuses": dict(self.statuses[label]),
+                **latency_summary(values),
+            }
+            for label, values in sorted(self.latencies.items())
+        }
+
+
+async def drive(client: httpx.AsyncClient, users: List[SyntheticUser], recorder: Recorder, args) -> float:
+    """Send the mix at args.rps for args.duration seconds; returns the elapsed time"""
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    loop = asyncio.get_running_loop()
+    in_flight = set()
+    started = loop.time()
+    next_at = started
+    while next_at < started + args.duration:
+        if len(in_flight) < args.max_in_flight:
+            operation = OPERATIONS[random.choices(names, weights)[0]]
+            task = asyncio.create_task(recorder.send(client, random.choice(users), operation, args))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        else:
+            recorder.skipped += 1
+        next_at += 1 / args.rps
+        await asyncio.sleep(max(next_at - loop.time(), 0))
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return loop.time() - started
+
+
+async def sample_connections(engine, samples: List[dict], stop: asyncio.Event) -> None:
+    from sqlalchemy import text
+
+    query = text(
+        "SELECT count(*) AS total, count(*) FILTER (WHERE state = 'active') AS active, "
+        "count(*) FILTER (WHERE state = 'idle in transaction') AS idle_in_transaction "
+        "FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()"
+    )
+    async with engine.connect() as conn:
+        while not stop.is_set():
+            row = (await conn.execute(query)).one()
+            samples.append(dict(row._mapping))
+            await conn.rollback()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def expire_timers(engine, user_ids: List[str]) -> int:
+    """Move the users' active timers on one shard into the past, forecast counters included"""
+    # The app reads its settings at import time; the forecast bucket settings
+    # must match the server's (same EXPIRY_FORECAST_* environment)
+    os.environ.setdefault("DATABASE_URL", str(engine.url))
+    os.environ.setdefault("SECRET_KEY", "load-test-secret-key")
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from app import crud
+
+    async with AsyncSession(engine) as db:
+        result = await db.execute(
+            text("UPDATE timers SET deadline = now() AT TIME ZONE 'utc' - interval '1 second' "
+                 "FROM (SELECT user_id, deadline FROM timers "
+                 "WHERE user_id = ANY(CAST(:ids AS uuid[])) AND status = 'ACTIVE' FOR UPDATE) AS previous "
+                 "WHERE timers.user_id = previous.user_id "
+                 "RETURNING timers.user_id, previous.deadline, timers.deadline"),
+            {"ids": user_ids}
+        )
+        moved = result.all()
+        # The same shift the API applies when it moves a deadline, so the forecast stays exact
+        await crud.shift_expiry_forecast(db, [
+            change
+            for user_id, previous, deadline in moved
+            for change in ((user_id, previous, -1), (user_id, deadline, 1))
+        ])
+        await db.commit()
+    return len(moved)
+
+
+async def force_expiry(engines, redis_url: str, cohort: List[SyntheticUser], args) -> dict:
+    """Expire the cohort's timers on every shard, enqueue the expiry task and time each TRIGGERED event"""
+    import redis.asyncio as redis
+    from celery import Celery
+
+    await asyncio.sleep(args.expire_at)
+    pending = {user.user_id for user in cohort}
+    client = redis.from_url(redis_url)
+    pubsub = client.pubsub()
+    await pubsub.psubscribe("timer:*")
+    lags = []
+    try:
+        # Each user's timer lives on exactly one shard, so running the update
+        # everywhere reaches the whole cohort without resolving its shards
+        forced = sum(await asyncio.gather(*(expire_timers(engine, list(pending)) for engine in engines)))
+        forced_at = time.perf_counter()
+        Celery(broker=redis_url).send_task("app.worker.check_expired_timers")
+
+        deadline = forced_at + args.trigger_timeout
+        while pending and time.perf_counter() < deadline:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is None:
+                continue
+            user_id = message["channel"].decode().split(":", 1)[1]
+            if user_id in pending and json.loads(message["data"]).get("status") == "TRIGGERED":
+                pending.discard(user_id)
+                lags.append(time.perf_counter() - forced_at)
+    finally:
+        await pubsub.punsubscribe()
+        await pubsub.close()
+        await client.close()
+    return {"forced": forced, "triggered": len(lags), "missing": len(pending), **latency_summary(lags)}
+
+
+async def run(args) -> dict:
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        prefix = uuid.uuid4().hex[:8]
+        users = [SyntheticUser(f"load-{prefix}-{i}@example.com") for i in range(args.users + args.expire_users)]
+        semaphore = asyncio.Semaphore(args.setup_concurrency)
+
+        async def setup(user):
+            async with semaphore:
+                await setup_user(client, user, args.vault_bytes)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(setup(user) for user in users))
+        print(f"Registered {len(users)} users in {time.perf_counter() - started:.1f}s")
+        # The expiry cohort gets no traffic, so no heartbeat moves its deadlines back out
+        traffic, cohort = users[:args.users], users[args.users:]
+
+        engines = []
+        connection_samples: List[dict] = []
+        stop = asyncio.Event()
+        background = []
+        if args.database_url:
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            engines = [create_async_engine(url, pool_size=2) for url in [args.database_url, *args.shard_database_url]]
+            background.append(asyncio.create_task(sample_connections(engines[0], connection_samples, stop)))
+        expiry = None
+        if engines and cohort:
+            expiry = asyncio.create_task(force_expiry(engines, args.redis_url, cohort, args))
+
+        recorder = Recorder()
+        elapsed = await drive(client, traffic, recorder, args)
+        report = {
+            "offered_rps": args.rps,
+            "achieved_rps": sum(len(v) for v in recorder.latencies.values()) / elapsed,
+            "skipped_over_max_in_flight": recorder.skipped,
+            "endpoints": recorder.report(elapsed),
+        }
+
+        if expiry is not None:
+            report["trigger_lag"] = await expiry
+        stop.set()
+        await asyncio.gather(*background)
+        if connection_samples:
+            report["db_connections"] = {
+                key: {"max": max(s[key] for s in connection_samples),
+                      "mean": statistics.fmean(s[key] for s in connection_samples)}
+                for key in ("total", "active", "idle_in_transaction")
+            }
+        for engine in engines:
+            await engine.dispose()
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"\nOffered {report['offered_rps']:.0f} rps, achieved {report['achieved_rps']:.1f} rps "
+          f"({report['skipped_over_max_in_flight']} skipped at max in-flight)")
+    print(f"{'endpoint':<38} {'reqs':>7} {'rps':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+    for label, stats in report["endpoints"].items():
+        statuses = " ".join(f"{code}:{count}" for code, count in sorted(stats["statuses"].items()))
+        print(f"{label:<38} {stats['requests']:>7} {stats['throughput_rps']:>8.1f} {stats['p50_ms']:>9.1f} "
+              f"{stats['p90_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}  {statuses}")
+    if "db_connections" in report:
+        connections = report["db_connections"]
+        print("\nDB connections: " + ", ".join(
+            f"{key} max {value['max']} / mean {value['mean']:.1f}" for key, value in connections.items()
+        ))
+    if "trigger_lag" in report:
+        lag = report["trigger_lag"]
+        print(f"Trigger lag: {lag['triggered']}/{lag['forced']} triggered ({lag['missing']} missing), "
+              f"p50 {lag['p50_ms'] / 1000:.2f}s, p99 {lag['p99_ms'] / 1000:.2f}s, max {lag['max_ms'] / 1000:.2f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive a realistic request mix against a running API")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=200, help="users that receive traffic")
+    parser.add_argument("--rps", type=float, default=100.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of traffic")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help="operation=weight,...")
+    parser.add_argument("--vault-bytes", type=int, default=4096, help="ciphertext size of each vault")
+    parser.add_argument("--connections", type=int, default=200, help="HTTP connection pool size")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="cap on outstanding requests")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--setup-concurrency", type=int, default=20, help="concurrent registrations")
+    parser.add_argument("--database-url", default=None,
+                        help="database to sample connections from and force expiries in (shard 0)")
+    parser.add_argument("--shard-database-url", action="append", default=[],
+                        help="further shard database, in the server's SHARD_DATABASE_URLS order (repeatable)")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0",
+                        help="Celery broker / timer event bus, for the expiry run")
+    parser.add_argument("--expire-users", type=int, default=50, help="size of the forced-expiry cohort")
+    parser.add_argument("--expire-at", type=float, default=10.0, help="seconds into the run to force expiry")
+    parser.add_argument("--trigger-timeout", type=float, default=120.0, help="how long to wait for triggers")
+    parser.add_argument("--output", default=None, help="also write the report as JSON here")
+    args = parser.parse_args()
+    if not args.database_url:
+        args.expire_users = 0
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
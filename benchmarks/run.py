@@ -0,0 +1,277 @@
+"""Microbenchmarks for the crud, auth and serialization hot paths.
+
+Usage:
+    python -m benchmarks.run [--database-url URL] [--only NAME] [--output results.json]
+                             [--baseline benchmarks/baseline.json] [--threshold 0.2]
+                             [--save-baseline] [--quick]
+
+CPU-only benchmarks (password hashing, token decoding, response
+serialization) always run. ``serialize.vault_list.*`` is FastAPI's
+``response_model`` path from ORM objects and ``serialize.vault_rows.*`` the
+row-to-orjson path the vault endpoints use; ``cpu_mean_ms`` is the CPU time
+per response.
+
+Database benchmarks run when a Postgres URL is given (``--database-url`` or
+``BENCH_DATABASE_URL``): a throwaway database is created next to the one in
+the URL, seeded, and dropped afterwards, so the URL can point at the local
+docker-compose Postgres.
+
+Results are written as JSON. When a baseline file exists, any benchmark whose
+median is more than ``--threshold`` (default 20%) slower than the baseline
+fails the run with exit status 1. ``--save-baseline`` stores the current
+results as the new baseline.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import uuid
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+# The app reads its settings at import time; none of them matter here except
+# the secret used to sign tokens
+os.environ.setdefault("DATABASE_URL", os.environ.get("BENCH_DATABASE_URL", "postgresql+asyncpg://localhost/unused"))
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+from sqlalchemy import insert, text  # noqa: E402
+from sqlalchemy.engine import make_url  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+
+from app import crud, schemas  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.dependencies import get_current_user  # noqa: E402
+from app.models import Timer, TimerStatus, User, Vault  # noqa: E402
+from app.serialization import json_rows  # noqa: E402
+from app.routers.auth import create_access_token  # noqa: E402
+from app.sharding import token_user_id  # noqa: E402
+from app.worker import run_async  # noqa: E402
+from benchmarks import harness  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Timer table sizes for get_expired_timers; 1% of timers are past their deadline
+EXPIRED_TIMER_TABLE_SIZES = [1_000, 10_000, 100_000]
+EXPIRED_FRACTION = 0.01
+
+# Vault list shapes for serialization: (label, vault count, ciphertext bytes per vault)
+VAULT_SHAPES = [
+    ("1x1KB", 1, 1024),
+    ("50x4KB", 50, 4096),
+    ("1x4MB", 1, 4 * 1024 * 1024),
+    ("5x2MB", 5, 2 * 1024 * 1024),
+]
+
+PASSWORD = "correct horse battery staple"
+
+
+def _vaults(count: int, size: int) -> List[Vault]:
+    user_id = uuid.uuid4()
+    # Base64 ciphertext: ASCII only, like real client-encrypted payloads
+    ciphertext = ("QUJDRA" * (size // 6 + 1))[:size]
+    return [
+        Vault(id=uuid.uuid4(), user_id=user_id, name=f"vault-{i}", encrypted_data=ciphertext, client_salt="c2FsdA==")
+        for i in range(count)
+    ]
+
+
+# Stands in for the SQLAlchemy Row the vault endpoints serialize (same _asdict())
+VaultRow = namedtuple("VaultRow", list(schemas.VaultResponse.model_fields))
+
+
+def _timer() -> Timer:
+    now = datetime.utcnow()
+    return Timer(
+        user_id=uuid.uuid4(),
+        status=TimerStatus.ACTIVE,
+        timeout_days=30,
+        last_checkin=now,
+        deadline=now + timedelta(days=30),
+    )
+
+
+async def _render(field, content) -> bytes:
+    """What FastAPI does with a handler's return value: validate, serialize, JSON-encode"""
+    return JSONResponse(await serialize_response(field=field, response_content=content)).body
+
+
+async def cpu_benchmarks(quick: bool) -> Dict[str, dict]:
+    results = {}
+    scale = 0.2 if quick else 1.0
+
+    password_hash = crud.get_password_hash(PASSWORD)
+    results["auth.verify_password"] = await harness.measure(
+        lambda: crud.verify_password(PASSWORD, password_hash), iterations=max(int(20 * scale), 3)
+    )
+
+    token = create_access_token({"sub": "bench@example.com", "uid": str(uuid.uuid4())})
+    results["auth.decode_token"] = await harness.measure(
+        lambda: token_user_id(token), iterations=max(int(2000 * scale), 50)
+    )
+
+    vault_list = create_response_field(name="Response_List_VaultResponse", type_=List[schemas.VaultResponse])
+    for label, count, size in VAULT_SHAPES:
+        vaults = _vaults(count, size)
+        iterations = max(int((20 if size >= 1024 * 1024 else 500) * scale), 3)
+        results[f"serialize.vault_list.{label}"] = await harness.measure(
+            lambda: _render(vault_list, vaults), iterations=iterations
+        )
+        # The path GET /vaults takes: column rows straight to orjson
+        rows = [VaultRow(*(getattr(vault, name) for name in VaultRow._fields)) for vault in vaults]
+        results[f"serialize.vault_rows.{label}"] = await harness.measure(
+            lambda: json_rows(rows).body, iterations=iterations
+        )
+
+    async def noop():
+        pass
+
+    # Fixed cost of handing a Celery task's coroutine to the worker's event loop
+    results["worker.run_async"] = await harness.measure(
+        lambda: run_async(noop()), iterations=max(int(2000 * scale), 50)
+    )
+
+    timer_field = create_response_field(name="Response_TimerResponse", type_=schemas.TimerResponse)
+    timer = _timer()
+    results["serialize.timer"] = await harness.measure(
+        lambda: _render(timer_field, timer), iterations=max(int(2000 * scale), 50)
+    )
+    return results
+
+
+@asynccontextmanager
+async def throwaway_database(url: str):
+    """Create a fresh database on the server in url, with the app's schema; drop it on exit"""
+    name = f"safekeep_bench_{uuid.uuid4().hex[:12]}"
+    admin = create_async_engine(url, isolation_level="AUTOCOMMIT")
+    async with admin.connect() as conn:
+        await conn.execute(text(f'CREATE DATABASE "{name}"'))
+    engine = create_async_engine(make_url(url).set(database=name), pool_size=5)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        yield engine
+    finally:
+        await engine.dispose()
+        async with admin.connect() as conn:
+            await conn.execute(text(f'DROP DATABASE IF EXISTS "{name}"'))
+        await admin.dispose()
+
+
+async def _seed_timers(engine: AsyncEngine, start: int, stop: int, password_hash: str) -> None:
+    """Add users start..stop-1 with timers; every 1/EXPIRED_FRACTION-th one is expired"""
+    now = datetime.utcnow()
+    every = int(1 / EXPIRED_FRACTION)
+    for chunk_start in range(start, stop, 10_000):
+        users, timers = [], []
+        for i in range(chunk_start, min(chunk_start + 10_000, stop)):
+            user_id = uuid.uuid4()
+            users.append({"id": user_id, "email": f"bench{i}@example.com", "hashed_password": password_hash, "is_active": True})
+            deadline = now - timedelta(hours=1) if i % every == 0 else now + timedelta(days=30)
+            timers.append({
+                "user_id": user_id,
+                "status": TimerStatus.ACTIVE,
+                "timeout_days": 30,
+                "last_checkin": deadline - timedelta(days=30),
+                "deadline": deadline,
+            })
+        async with engine.begin() as conn:
+            await conn.execute(insert(User), users)
+            await conn.execute(insert(Timer), timers)
+    async with engine.connect() as conn:
+        await conn.execute(text("ANALYZE users"))
+        await conn.execute(text("ANALYZE timers"))
+        await conn.commit()
+
+
+async def database_benchmarks(url: str, quick: bool) -> Dict[str, dict]:
+    results = {}
+    scale = 0.2 if quick else 1.0
+    sizes = EXPIRED_TIMER_TABLE_SIZES[:2] if quick else EXPIRED_TIMER_TABLE_SIZES
+
+    async with throwaway_database(url) as engine:
+        sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        password_hash = crud.get_password_hash(PASSWORD)
+
+        async with sessions() as db:
+            user = await crud.create_user(db, schemas.UserCreate(email="hot@example.com", password=PASSWORD))
+            await crud.create_timer(db, user.id, schemas.TimerCreate(timeout_days=30))
+
+        async def checkin():
+            async with sessions() as db:
+                await crud.update_timer_checkin(db, user.id)
+
+        results["crud.update_timer_checkin"] = await harness.measure(checkin, iterations=max(int(500 * scale), 20))
+
+        token = create_access_token({"sub": user.email, "uid": str(user.id)})
+
+        async def authenticate():
+            async with sessions() as db:
+                await get_current_user(token=token, db=db)
+
+        results["auth.get_current_user"] = await harness.measure(authenticate, iterations=max(int(500 * scale), 20))
+
+        seeded = 0
+        for size in sizes:
+            await _seed_timers(engine, seeded, size, password_hash)
+            seeded = size
+
+            async def expired():
+                async with sessions() as db:
+                    await crud.get_expired_timers(db)
+
+            iterations = max(int(200 * scale * 1_000 / size), 5)
+            results[f"crud.get_expired_timers.{size}"] = await harness.measure(expired, iterations=iterations)
+    return results
+
+
+async def run(database_url: Optional[str], only: Optional[str], quick: bool) -> Dict[str, dict]:
+    results = await cpu_benchmarks(quick)
+    if database_url:
+        results.update(await database_benchmarks(database_url, quick))
+    else:
+        print("No --database-url / BENCH_DATABASE_URL given; skipping database benchmarks")
+    if only:
+        results = {name: result for name, result in results.items() if only in name}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the hot path microbenchmarks")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL"),
+                        help="Postgres server to create a throwaway benchmark database on")
+    parser.add_argument("--only", default=None, help="only report benchmarks whose name contains this")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed median slowdown vs the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations and smaller tables")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.database_url, args.only, args.quick))
+    harness.write_results(args.output, results)
+
+    baseline = harness.load_results(args.baseline) if os.path.exists(args.baseline) else None
+    harness.print_table(results, baseline)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        harness.write_results(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if baseline is not None:
+        regressions = harness.compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold * 100:.0f}%:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()